@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- Mode: python -*-
+
+# checks the cold-start import cost of modulecmd against a budget.  modulecmd is run with
+# python -X importtime (python 3.7 or later) for a trivial action, and the self time of
+# every module it imports beyond what a bare interpreter imports is added up.  the median
+# over several runs must stay under the time budget, and none of the modules that only
+# heavier actions need may be imported at all.  exits with a nonzero status if the budget
+# is exceeded.
+
+import optparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that a trivial action has no business importing.
+FORBIDDEN_MODULES = [
+    "ast",
+    "base64",
+    "copy",
+    "hashlib",
+    "json",
+    "marshal",
+    "multiprocessing",
+    "pickle",
+    "random",
+    "shutil",
+    "socket",
+    "tempfile",
+    "threading",
+    "zlib",
+]
+
+
+# run a python command line under -X importtime and return a dict mapping each imported
+# module to its self time in microseconds.
+def import_times(args, env):
+    process = subprocess.Popen([sys.executable, "-X", "importtime"] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               env=env, cwd=ROOT)
+    stdout, stderr = process.communicate()
+
+    times = dict()
+    for line in stderr.decode("utf-8", "replace").splitlines():
+        if (not line.startswith("import time:")):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if (len(fields) != 3 or
+            not fields[0].strip().isdigit()):
+            continue
+        times[fields[2].strip()] = int(fields[0])
+
+    # modulecmd writes the name of a temp file on success; clean up after it.
+    output = stdout.decode("utf-8").strip()
+    if (output and os.path.isfile(output)):
+        os.unlink(output)
+
+    return times
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [<options>]")
+    parser.add_option("--budget-ms", action="store", type="float", dest="budget_ms",
+                      help="maximum import time, in milliseconds, of the modules "
+                      "modulecmd imports beyond the bare interpreter")
+    parser.add_option("--runs", action="store", type="int", dest="runs",
+                      help="number of runs to take the median of")
+    parser.add_option("--action", action="store", dest="action",
+                      help="modulecmd action to run")
+    parser.set_defaults(budget_ms=30.0, runs=5, action="loaded")
+    (opts, args) = parser.parse_args()
+
+    if (sys.version_info < (3, 7)):
+        sys.stderr.write("-X importtime requires python 3.7 or later\n")
+        sys.exit(2)
+
+    env = dict([(key, value)
+                for key, value in os.environ.items()
+                if (not key.startswith("PYENV_DATA_") and
+                    key != "PYENV_SESSION")])
+    env["PYENV_CACHE_DIR"] = ""
+
+    baseline = set(import_times(["-c", "pass"], env).keys())
+
+    totals = []
+    extra_modules = set()
+    for run in range(opts.runs):
+        times = import_times([os.path.join(ROOT, "modulecmd"), "-s", "bash", opts.action],
+                             env)
+        extra = dict([(name, value)
+                      for name, value in times.items()
+                      if name not in baseline])
+        extra_modules.update(extra.keys())
+        totals.append(sum(extra.values()))
+
+    totals.sort()
+    median_ms = totals[len(totals) // 2] / 1000.0
+
+    failed = False
+    sys.stdout.write("modulecmd %s imports %d modules beyond the interpreter in %.1f ms "
+                     "(budget %.1f ms)\n" %
+                     (opts.action, len(extra_modules), median_ms, opts.budget_ms))
+    if (median_ms > opts.budget_ms):
+        sys.stdout.write("FAIL: import time is over budget\n")
+        failed = True
+
+    forbidden = sorted([name for name in extra_modules
+                        if name.split(".")[0] in FORBIDDEN_MODULES])
+    if (len(forbidden) != 0):
+        sys.stdout.write("FAIL: imports modules it does not need: %s\n" %
+                         ", ".join(forbidden))
+        failed = True
+
+    if (failed):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
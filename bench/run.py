@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- Mode: python -*-
+
+# times the hot paths of modulecmd against a synthetic module tree: scanning the module
+# database, finding modules, loading and unloading modules, shell savepoints, encoding the
+# environment state and generating the shell commands.  the results can be written out as
+# JSON, and compared against the JSON of an earlier run to catch regressions.
+#
+# the generated tree holds --modules modulefiles spread over directories --width wide and
+# --depth deep.  modules are grouped in dependency chains of --chain modules, and a hub
+# module depends on --fanout modules.  half of the modules declare their dependencies
+# statically, the other half in preload.
+
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pyenv
+from pyenv.shell import ShellConstants, shell_mapper
+
+timer = getattr(time, "perf_counter", time.time)
+
+STATIC_MODULE = """import pyenv
+
+class Module(pyenv.Module):
+    dependencies = %(dependencies)r
+    description = "synthetic module %(name)s"
+
+    def load(self, env, shell):
+        shell.prepend_path(%(prefix)r)
+        shell.add_env(%(variable)r, %(prefix)r)
+
+    def unload(self, env, shell):
+        self.unload_by_reversal(env, shell)
+"""
+
+DYNAMIC_MODULE = """import pyenv
+
+class Module(pyenv.Module):
+    def preload(self, env):
+        return %(dependencies)r
+
+    def load(self, env, shell):
+        shell.prepend_path(%(prefix)r)
+        shell.add_env(%(variable)r, %(prefix)r)
+
+    def unload(self, env, shell):
+        self.unload_by_reversal(env, shell)
+"""
+
+
+class BenchOptions(object):
+    dedup_paths = False
+    raw_msg_dump = False
+
+
+def module_name(opts, ix):
+    parts = ["d%02d" % ((ix // (opts.width ** level)) % opts.width)
+             for level in range(opts.depth)]
+    return ".".join(parts + ["m%05d" % ix])
+
+
+def module_dependencies(opts, ix):
+    if (ix % opts.chain == 0):
+        return []
+    return [module_name(opts, ix - 1)]
+
+
+# write out the synthetic module tree, and an install prefix for every module.
+def generate_tree(opts, root):
+    module_root = os.path.join(root, "modules")
+    prefix_root = os.path.join(root, "prefix")
+
+    for ix in range(opts.modules):
+        name = module_name(opts, ix)
+        prefix = os.path.join(prefix_root, "m%05d" % ix, "bin")
+        os.makedirs(prefix)
+
+        path = os.path.join(module_root, *name.split(".")) + ".py"
+        if (not os.path.isdir(os.path.dirname(path))):
+            os.makedirs(os.path.dirname(path))
+
+        template = STATIC_MODULE if ix % 2 == 0 else DYNAMIC_MODULE
+        with open(path, "w") as fh:
+            fh.write(template % {"name": name,
+                                 "dependencies": module_dependencies(opts, ix),
+                                 "prefix": prefix,
+                                 "variable": "M%05d_HOME" % ix})
+
+    # the hub depends on the head of as many chains as it can, and then on whatever else.
+    heads = [module_name(opts, ix) for ix in range(0, opts.modules, opts.chain)]
+    others = [module_name(opts, ix) for ix in range(opts.modules)
+              if ix % opts.chain != 0]
+    with open(os.path.join(module_root, "hub.py"), "w") as fh:
+        fh.write(STATIC_MODULE % {"name": "hub",
+                                  "dependencies": (heads + others)[:opts.fanout],
+                                  "prefix": prefix_root,
+                                  "variable": "HUB_HOME"})
+
+    # modulefiles written within the index's mtime grace period are not cached, so
+    # backdate everything.
+    backdate = time.time() - 3600
+    for dirpath, dirnames, filenames in os.walk(module_root):
+        for name in dirnames + filenames:
+            os.utime(os.path.join(dirpath, name), (backdate, backdate))
+    os.utime(module_root, (backdate, backdate))
+
+    return module_root
+
+
+# set up os.environ for a fresh invocation: no prior state and a long PATH.
+def reset_environ(opts, module_root, cache_root):
+    for key in list(os.environ.keys()):
+        if (key.startswith("PYENV_")):
+            del os.environ[key]
+
+    os.environ["PYENV_PATH"] = module_root
+    os.environ["PYENV_CACHE_DIR"] = cache_root
+    os.environ["PATH"] = os.pathsep.join(["/opt/synthetic/%04d/bin" % ix
+                                          for ix in range(opts.path_length)])
+
+
+# run function repeat times, calling setup before each run (untimed).  setup's return
+# value is passed to function.  returns the timings in seconds.
+def measure(function, setup, repeat):
+    timings = []
+    for run in range(repeat):
+        argument = setup() if setup is not None else None
+        start = timer()
+        function(argument)
+        timings.append(timer() - start)
+
+    timings.sort()
+    return {"runs": repeat,
+            "min": timings[0],
+            "median": timings[len(timings) // 2],
+            "mean": sum(timings) / len(timings)}
+
+
+def new_environment(shell_class = None):
+    from pyenv.db import ModuleDatabase
+    from pyenv.environment import Environment
+    from pyenv.statcache import StatCache
+
+    StatCache.reset()
+    if (shell_class is None):
+        shell_class = shell_mapper["bash"]
+    shell = shell_class(BenchOptions())
+    return Environment(shell, ModuleDatabase())
+
+
+def run_benchmarks(opts, module_root, cache_root):
+    from pyenv.db import ModuleDatabase
+    from pyenv.depgraph import DependencyGraph
+
+    results = dict()
+
+    def record(name, result):
+        results[name] = result
+        sys.stderr.write("%-32s %10.3f ms\n" % (name, result["median"] * 1000.0))
+
+    def cold_database():
+        shutil.rmtree(os.path.join(cache_root, "index"), True)
+        return ModuleDatabase()
+
+    record("populate_db_cache.cold",
+           measure(lambda mdb: mdb.populate_db_cache(), cold_database, opts.repeat))
+    record("populate_db_cache.warm",
+           measure(lambda mdb: mdb.populate_db_cache(), ModuleDatabase, opts.repeat))
+
+    # a spread of existing modules, plus as many that do not exist.
+    step = max(1, opts.modules // opts.lookups)
+    lookups = [module_name(opts, ix) for ix in range(0, opts.modules, step)]
+    lookups.extend(["%s.missing" % name for name in list(lookups)])
+
+    def find_all(mdb):
+        for name in lookups:
+            mdb.find_module(name)
+
+    record("find_module", measure(find_all, ModuleDatabase, opts.repeat))
+
+    chain_tail = module_name(opts, min(opts.chain, opts.modules) - 1)
+    record("load.chain",
+           measure(lambda env: env.load_modules_by_name([chain_tail]),
+                   new_environment, opts.repeat))
+    record("load.wide",
+           measure(lambda env: env.load_modules_by_name(["hub"]),
+                   new_environment, opts.repeat))
+
+    def loaded_environment():
+        env = new_environment()
+        env.load_modules_by_name(["hub"])
+        return env
+
+    def unload_all(env):
+        for name in env.unload_order(list(env.loaded_modules)):
+            env.unload_module_by_name(name)
+
+    record("unload.wide", measure(unload_all, loaded_environment, opts.repeat))
+
+    def push_pop(shell):
+        for savepoint in range(100):
+            shell.push()
+            for ix in range(10):
+                shell.prepend_path("/opt/savepoint/%d" % ix, "PATH", ShellConstants.NOT_PATH)
+                shell.add_env("SAVEPOINT_%d" % ix, str(savepoint))
+            shell.pop()
+
+    record("shell.push_pop",
+           measure(push_pop, lambda: shell_mapper["bash"](BenchOptions()), opts.repeat))
+
+    # the state of a large environment: every module loaded, with the chain edges.
+    all_modules = [module_name(opts, ix) for ix in range(opts.modules)]
+    dependents = dict()
+    for ix in range(opts.modules):
+        for dependency in module_dependencies(opts, ix):
+            dependents.setdefault(dependency, set()).add(module_name(opts, ix))
+
+    def stateful_environment():
+        env = new_environment()
+        env.loaded_modules = set(all_modules)
+        env.graph = DependencyGraph.from_dependents(dependents)
+        env.need_env_dump = True
+        return env
+
+    record("shutdown", measure(lambda env: env.shutdown(), stateful_environment, opts.repeat))
+
+    for shell_name in sorted(shell_mapper.keys()):
+        def busy_shell():
+            shell = shell_mapper[shell_name](BenchOptions())
+            for ix in range(opts.fanout):
+                shell.prepend_path("/opt/busy/%d/bin" % ix, "PATH", ShellConstants.NOT_PATH)
+                shell.append_compiler_flag("/opt/busy/%d/include" % ix, "CPPFLAGS", "-I")
+                shell.add_env("BUSY_%d" % ix, "/opt/busy/%d" % ix)
+                shell.write("loaded busy %d" % ix)
+            return shell
+
+        record("dump_state.%s" % shell_name,
+               measure(lambda shell: shell.dump_state(), busy_shell, opts.repeat))
+
+    return results
+
+
+# compare the medians of two runs.  returns the names of the benchmarks that got slower
+# than threshold allows.
+def compare(baseline, current, threshold):
+    if (baseline.get("parameters") != current["parameters"]):
+        sys.stderr.write("warning: the runs used different parameters\n")
+
+    regressions = []
+    sys.stdout.write("%-32s %12s %12s %8s\n" % ("benchmark", "baseline ms", "current ms",
+                                                 "ratio"))
+    for name in sorted(current["results"].keys()):
+        if (name not in baseline["results"]):
+            continue
+
+        before = baseline["results"][name]["median"]
+        after = current["results"][name]["median"]
+        ratio = after / before if before > 0 else 1.0
+        flag = ""
+        if (ratio > threshold):
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        sys.stdout.write("%-32s %12.3f %12.3f %8.2f%s\n" %
+                         (name, before * 1000.0, after * 1000.0, ratio, flag))
+
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [<options>]")
+    parser.add_option("--modules", action="store", type="int", dest="modules",
+                      help="number of modulefiles to generate")
+    parser.add_option("--width", action="store", type="int", dest="width",
+                      help="number of subdirectories per directory")
+    parser.add_option("--depth", action="store", type="int", dest="depth",
+                      help="nesting depth of the module directories")
+    parser.add_option("--chain", action="store", type="int", dest="chain",
+                      help="length of the dependency chains")
+    parser.add_option("--fanout", action="store", type="int", dest="fanout",
+                      help="number of modules the hub module depends on")
+    parser.add_option("--path-length", action="store", type="int", dest="path_length",
+                      help="number of components in PATH")
+    parser.add_option("--lookups", action="store", type="int", dest="lookups",
+                      help="number of existing modules looked up by find_module")
+    parser.add_option("--repeat", action="store", type="int", dest="repeat",
+                      help="number of times each benchmark is run")
+    parser.add_option("--output", action="store", dest="output",
+                      help="write the results as JSON to this file")
+    parser.add_option("--compare", action="store", dest="compare",
+                      help="compare the results against the JSON of an earlier run")
+    parser.add_option("--threshold", action="store", type="float", dest="threshold",
+                      help="with --compare, the ratio of medians above which a "
+                      "benchmark counts as a regression")
+    parser.add_option("--keep", action="store_true", dest="keep",
+                      help="keep the synthetic module tree instead of deleting it")
+    parser.set_defaults(modules=2000, width=10, depth=2, chain=50, fanout=100,
+                        path_length=200, lookups=200, repeat=5, threshold=1.25)
+    (opts, args) = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="pyenv-bench-")
+    try:
+        module_root = generate_tree(opts, root)
+        cache_root = os.path.join(root, "cache")
+        reset_environ(opts, module_root, cache_root)
+
+        current = {
+            "python": sys.version.split()[0],
+            "parameters": dict([(name, getattr(opts, name))
+                                for name in ("modules", "width", "depth", "chain",
+                                             "fanout", "path_length", "lookups",
+                                             "repeat")]),
+            "results": run_benchmarks(opts, module_root, cache_root),
+        }
+    finally:
+        if (opts.keep):
+            sys.stderr.write("synthetic tree kept in %s\n" % root)
+        else:
+            shutil.rmtree(root, True)
+
+    if (opts.output is not None):
+        with open(opts.output, "w") as fh:
+            json.dump(current, fh, indent = 2, sort_keys = True)
+            fh.write("\n")
+
+    if (opts.compare is not None):
+        with open(opts.compare) as fh:
+            baseline = json.load(fh)
+        if (compare(baseline, current, opts.threshold)):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- Mode: python -*-
+
+# compares the environment footprint of the original PYENV_DATA encoding (a base64 pickle
+# in 100 character chunks) with the current one, for increasing numbers of loaded modules.
+
+import base64
+import optparse
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyenv import state
+
+
+# a plausible set of loaded modules: every module depends on a compiler and an mpi, and
+# every third module depends on the one before it.
+def synthetic_state(count):
+    modules = ["compilers.gcc.12_2_0", "mpi.openmpi.4_1_5"]
+    modules.extend(["apps.package%03d.1_%d_0" % (ix, ix % 7) for ix in range(count - 2)])
+
+    dependencies = {
+        modules[0]: set(modules[1:]),
+        modules[1]: set(modules[2:]),
+    }
+    for ix in range(3, len(modules), 3):
+        dependencies.setdefault(modules[ix - 1], set()).add(modules[ix])
+
+    return (set(modules), dependencies)
+
+
+def legacy_chunks(loaded_modules, dependencies):
+    encoded = base64.b64encode(pickle.dumps((loaded_modules, dependencies), 2)).decode("latin-1")
+    return [("PYENV_DATA_%d" % chunk_no, encoded[ix:ix + 100])
+            for chunk_no, ix in enumerate(range(0, len(encoded), 100))]
+
+
+# bytes the variables occupy in a child's environment block.
+def footprint(chunks):
+    return sum([len(name) + len(value) + 2 for name, value in chunks])
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [<options>]")
+    parser.add_option("--chunk-size", action="store", type="int", dest="chunk_size",
+                      help="chunk size for the current encoding")
+    parser.set_defaults(chunk_size=state.DEFAULT_CHUNK_SIZE)
+    (opts, args) = parser.parse_args()
+
+    sys.stdout.write("%8s  %18s  %18s\n" % ("modules", "legacy vars/bytes", "current vars/bytes"))
+    for count in (5, 10, 20, 40, 80, 160):
+        loaded_modules, dependencies = synthetic_state(count)
+
+        legacy = legacy_chunks(loaded_modules, dependencies)
+        current = state.split_chunks(state.encode_state(loaded_modules, dependencies),
+                                     opts.chunk_size)
+        assert(state.decode_state("".join([value for name, value in current])) ==
+               (loaded_modules, dependencies))
+
+        sys.stdout.write("%8d  %8d/%9d  %8d/%9d\n" %
+                         (count,
+                          len(legacy), footprint(legacy),
+                          len(current), footprint(current)))
+
+if __name__ == "__main__":
+    main()
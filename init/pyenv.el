@@ -0,0 +1,18 @@
+;; -*- Mode: emacs-lisp -*-
+
+;; load this to define the module command in emacs.  the commands modulecmd generates are
+;; read straight from its stdout, so no temp file is created.
+
+(defvar pyenv-modulecmd "modulecmd"
+  "The modulecmd (or modulecmd-client) program to run.")
+
+(defun module (&rest args)
+  "Run modulecmd with ARGS and apply the changes it generates."
+  (interactive (split-string (read-string "module ")))
+  (let ((commands (with-temp-buffer
+                    (apply #'call-process pyenv-modulecmd nil '(t nil) nil
+                           "-s" "elisp" "--output" "stdout" args)
+                    (buffer-string))))
+    (eval (car (read-from-string (concat "(progn " commands ")"))))))
+
+(provide 'pyenv)
@@ -1,15 +1,58 @@
-# -*- Mode: Python -*- 
+# -*- Mode: Python -*-
 
-__all__ = ['db',
+__all__ = ['api',
+           'command',
+           'db',
            'environment',
            'errors',
            'module',
            'shell',
            ]
 
-from .actions import Actions
-from .db import ModuleDatabase
-from .environment import Environment
+import sys
+
 from .errors import *
-from .module import Module
-from .shell import *
+
+# everything else is imported the first time it is used, so that a modulecmd invocation
+# only pays for the parts of the package it actually needs.  this maps each lazily
+# imported name to the submodule that provides it.
+lazy_attributes = {
+    'Actions': 'actions',
+    'ModuleDatabase': 'db',
+    'Environment': 'environment',
+    'Module': 'module',
+    'ShellConstants': 'shell',
+    'Shell': 'shell',
+    'TcshShell': 'shell',
+    'BashShell': 'shell',
+    'Elisp': 'shell',
+    'DeltaShell': 'shell',
+    'shell_mapper': 'shell',
+}
+
+
+def __getattr__(name):
+    import importlib
+
+    if (name.startswith("_")):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    elif (name in lazy_attributes):
+        submodule = importlib.import_module(".%s" % lazy_attributes[name], __name__)
+        value = getattr(submodule, name)
+    else:
+        try:
+            value = importlib.import_module(".%s" % name, __name__)
+        except ImportError:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    globals()[name] = value
+    return value
+
+
+# module-level __getattr__ is only honored from python 3.7 on.  import everything up front
+# on older interpreters.
+if (sys.version_info < (3, 7)):
+    for name in lazy_attributes:
+        __getattr__(name)
+    from . import command
+    del name
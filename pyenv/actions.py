@@ -4,11 +4,15 @@ import sys
 
 from . import options
 from .errors import *
-from .db import ModuleDatabase
-from .environment import Environment
-from .shell import shell_mapper
 
 class Actions(object):
+    # actions that only look at the state the shell carries.  they are run without a
+    # module database or an environment (env and mdb are None), so they don't pay for
+    # setting up, or even importing, either.
+    STATE_ONLY_ACTIONS = ("loaded",)
+
+
+
     @classmethod
     def get_all_actions(cls):
         all_actions = dict([(name, getattr(cls, name))
@@ -31,7 +35,7 @@ class Actions(object):
                               dest="prefix")
             parser.add_option("--force", action="store_true",
                               help="forcibly load the module, even if it is "
-                              "already loaded",
+                              "already loaded, and look for its modulefile again",
                               dest="force")
             parser.set_defaults(prefix="")
 
@@ -65,19 +69,20 @@ class Actions(object):
                                     action_optparse_check = custom_optparse_checker,
                                     action_optparse_help_generator = custom_format_help_generator)
 
-        for module_name in options.ActionOptions.args:
-            try:
-                module_name = "%s%s" % (options.ActionOptions.prefix, module_name)
-                shell.push()
-                env.load_module_by_name(module_name, options.ActionOptions.force)
-            except ModuleLoadError as e:
-                wlog.log(str(e))
-                shell.pop()
+        modules_to_load = ["%s%s" % (options.ActionOptions.prefix, module_name)
+                           for module_name in options.ActionOptions.args]
+
+        for error in env.load_modules_by_name(modules_to_load, options.ActionOptions.force):
+            wlog.log(str(error))
 
 
     @staticmethod
     def loaded(action, args, env, shell, mdb):
-        all_loaded_modules = list(env.loaded_modules)
+        import os
+        from . import state
+
+        loaded_modules, dependents, chunk_count = state.read_state(os.environ)
+        all_loaded_modules = list(loaded_modules)
         all_loaded_modules.sort()
         [shell.write(module)
          for module in all_loaded_modules]
@@ -126,33 +131,197 @@ class Actions(object):
                                     action_optparse_check = custom_optparse_checker,
                                     action_optparse_help_generator = custom_format_help_generator)
 
-        modules_to_unload = set(options.ActionOptions.args)
+        modules_to_unload = ["%s%s" % (options.ActionOptions.prefix, module_name)
+                             for module_name in options.ActionOptions.args]
 
-        last_round = False
-        while (len(modules_to_unload) != 0):
-            unload_this_round = [module_name
-                                 for module_name in modules_to_unload
-                                 if env.okay_to_unload(module_name)]
+        # unload dependents before the modules they depend on.  anything that still has
+        # dependents when its turn comes generates an error message.
+        for module_name in env.unload_order(modules_to_unload):
+            try:
+                env.unload_module_by_name(module_name)
+            except ModuleUnloadError as e:
+                wlog.log(str(e))
 
-            if (len(unload_this_round) == 0):
-                # nothing can be unloaded this round, so generate all the error messages
-                # and quit.
-                last_round = True
-                unload_this_round = modules_to_unload.copy()
 
-            for module_name in unload_this_round:
-                try:
-                    module_name = "%s%s" % (options.ActionOptions.prefix, module_name)
-                    env.unload_module_by_name(module_name)
-                except ModuleUnloadError as e:
-                    modules_to_unload.remove(module_name)
-                    wlog.log(str(e))
-                else:
-                    modules_to_unload.remove(module_name)
+    @staticmethod
+    def swap(action, args, env, shell, mdb):
+        action_name = "swap"
+        wlog = WarningLog.get_logger()
+
+
+        def custom_optparse_setup(parser):
+            parser.add_option("--prefix", action="store",
+                              help="prefix to prepend to module names; "
+                              "should probably end with \".\"",
+                              dest="prefix")
+            parser.set_defaults(prefix="")
+
+
+        def custom_optparse_checker(options_store, args):
+            if (len(args) != 2):
+                return False
+            return True
+
+
+        def custom_format_help_generator(options_help):
+            def custom_format_help(formatter=None):
+                prog = sys.argv[0]
+                result = ("usage: %s [<options>]"
+                          " %s [<%s options>] <outgoing module> <incoming module>\n\n"
+                          "%s\n"
+                          "%s %s\n" %
+                          (prog,
+                           action, action_name,
+                           options.TopLevelOptions.options_help,
+                           action_name, options_help))
+                return result
+
+            return custom_format_help
+
+
+        options.ActionOptions.parse(shell,
+                                    action_name, args,
+                                    options.TopLevelOptions.options_help,
+                                    action_optparse_setup = custom_optparse_setup,
+                                    action_optparse_check = custom_optparse_checker,
+                                    action_optparse_help_generator = custom_format_help_generator)
+
+        outgoing, incoming = ["%s%s" % (options.ActionOptions.prefix, module_name)
+                              for module_name in options.ActionOptions.args]
+
+        try:
+            env.swap_module_by_name(outgoing, incoming)
+        except ModuleError as e:
+            wlog.log(str(e))
 
 
     @staticmethod
     def avail(action, args, env, shell, mdb):
-        all_modules = mdb.get_all_modules()
-        all_modules.sort()
-        shell.write("\n".join(all_modules))
+        action_name = "avail"
+
+
+        def custom_optparse_setup(parser):
+            parser.add_option("--details", action="store_true",
+                              help="show the family, dependencies and description of "
+                              "each module, as declared in its modulefile",
+                              dest="details")
+
+
+        def custom_format_help_generator(options_help):
+            def custom_format_help(formatter=None):
+                prog = sys.argv[0]
+                result = ("usage: %s [<options>]"
+                          " %s [<%s options>] [<prefix or pattern> ...]\n\n"
+                          "%s\n"
+                          "%s %s\n" %
+                          (prog,
+                           action, action_name,
+                           options.TopLevelOptions.options_help,
+                           action_name, options_help))
+                return result
+
+            return custom_format_help
+
+
+        options.ActionOptions.parse(shell,
+                                    action_name, args,
+                                    options.TopLevelOptions.options_help,
+                                    action_optparse_setup = custom_optparse_setup,
+                                    action_optparse_help_generator = custom_format_help_generator)
+
+        # a dotted prefix (e.g., compilers.gcc) lists the modules under it, and a glob
+        # (e.g., "*mpi*") the modules it matches.  the names are generated in sorted order
+        # and streamed to the output as it is written.
+        all_modules = mdb.iter_all_modules(patterns = options.ActionOptions.args)
+
+        if (not options.ActionOptions.details):
+            shell.write_bulk(all_modules)
+            return
+
+        # the details come from the static metadata; no modulefile is executed.  the
+        # metadata is looked up now, so that it makes it into the saved indexes.
+        lines = []
+        for module_name in all_modules:
+            metadata = mdb.get_metadata(module_name)
+            if (metadata is None):
+                lines.append("%s (unreadable)" % module_name)
+                continue
+
+            details = []
+            if (metadata["family"] is not None):
+                details.append("family: %s" % metadata["family"])
+            if (metadata["dependencies"]):
+                details.append("requires: %s" % ", ".join(metadata["dependencies"]))
+            if (metadata["conflicts"]):
+                details.append("conflicts: %s" % ", ".join(metadata["conflicts"]))
+
+            line = module_name
+            if (len(details) != 0):
+                line = "%s [%s]" % (line, "; ".join(details))
+            if (metadata["description"] is not None):
+                line = "%s - %s" % (line, metadata["description"])
+            lines.append(line)
+
+        mdb.save_indexes()
+        shell.write_bulk(lines)
+
+
+    @staticmethod
+    def search(action, args, env, shell, mdb):
+        action_name = "search"
+
+
+        def custom_optparse_setup(parser):
+            parser.add_option("--substring", action="store_true",
+                              help="match terms anywhere inside words, not just whole words",
+                              dest="substring")
+            parser.add_option("--fuzzy", action="store_true",
+                              help="match words that are close to the terms, e.g., misspelled",
+                              dest="fuzzy")
+            parser.add_option("--rebuild", action="store_true",
+                              help="rebuild the search index first, e.g., to find "
+                              "modules whose descriptions were just edited to match",
+                              dest="rebuild")
+
+
+        def custom_optparse_checker(options_store, args):
+            if (len(args) == 0):
+                return False
+            return True
+
+
+        def custom_format_help_generator(options_help):
+            def custom_format_help(formatter=None):
+                prog = sys.argv[0]
+                result = ("usage: %s [<options>]"
+                          " %s [<%s options>] <term> [<term> ...]\n\n"
+                          "%s\n"
+                          "%s %s\n" %
+                          (prog,
+                           action, action_name,
+                           options.TopLevelOptions.options_help,
+                           action_name, options_help))
+                return result
+
+            return custom_format_help
+
+
+        options.ActionOptions.parse(shell,
+                                    action_name, args,
+                                    options.TopLevelOptions.options_help,
+                                    action_optparse_setup = custom_optparse_setup,
+                                    action_optparse_check = custom_optparse_checker,
+                                    action_optparse_help_generator = custom_format_help_generator)
+
+        from .search import SearchIndex
+
+        # modules that match every term, in their names or their descriptions.  those that
+        # match in their names come first.
+        results = SearchIndex.search_database(mdb, options.ActionOptions.args,
+                                              substring = options.ActionOptions.substring,
+                                              fuzzy = options.ActionOptions.fuzzy,
+                                              rebuild = options.ActionOptions.rebuild)
+
+        shell.write_bulk([module_name if description is None
+                          else "%s - %s" % (module_name, description)
+                          for module_name, description in results])
@@ -0,0 +1,87 @@
+# -*- Mode: Python -*-
+
+import os
+
+from .errors import *
+from .statcache import StatCache
+from .timings import Timings
+
+# an in-process interface for programs, such as job launchers, that need the environment a
+# list of modules produces, without running modulecmd in a subprocess and parsing the shell
+# commands it writes:
+#
+#   mdb = pyenv.api.module_database(base_environ)
+#   delta = pyenv.api.environment_delta(base_environ, ["compilers.gcc", "lib.mpi"], mdb)
+#
+# the delta maps each environment variable that changes to its new value, or to None if it
+# is unset.  it includes the encoded state (PYENV_DATA_<n> or PYENV_SESSION), so that
+# modulecmd run later in the resulting environment knows what is loaded.
+#
+# like the server, this relies on process-global state: while the modules are loaded,
+# os.environ is replaced by a copy of the base environment, since that is where modulefiles
+# (and pyenv itself) look.  calls must therefore not be made from several threads at once.
+
+
+# options for the DeltaShell, standing in for the parsed command line.
+class DeltaOptions(object):
+    raw_msg_dump = False
+
+
+    def __init__(self, dedup_paths = False):
+        self.dedup_paths = dedup_paths
+
+
+# run function with os.environ replaced by a copy of base_environ.
+def with_environ(base_environ, function):
+    saved_environ = os.environ
+    os.environ = dict(base_environ)
+    try:
+        return function()
+    finally:
+        os.environ = saved_environ
+
+
+# return a module database for base_environ (i.e., for its PYENV_PATH).  a database can be
+# reused across environment_delta calls with the same PYENV_PATH, which keeps its index and
+# compiled modulefiles warm.
+def module_database(base_environ):
+    from .db import ModuleDatabase
+
+    return with_environ(base_environ, ModuleDatabase)
+
+
+# load module_names into base_environ and return the resulting environment delta.  if mdb
+# is not specified, a new module database is used.  with force, modules that are already
+# loaded are loaded again.  raises the first ModuleError that occurred, if any.
+def environment_delta(base_environ, module_names, mdb = None, force = False,
+                      dedup_paths = False):
+    from .environment import Environment
+    from .shell import DeltaShell
+
+    def load():
+        from .db import ModuleDatabase
+
+        # like the server does for each request, start over, so that nothing created
+        # since an earlier call (a modulefile, a path) is still taken to be missing, and
+        # the timings of earlier calls don't pile up.
+        StatCache.reset()
+        Timings.reset()
+
+        shell = DeltaShell(DeltaOptions(dedup_paths))
+        if (mdb is not None):
+            db = mdb
+            db.reset_db_cache()
+        else:
+            db = ModuleDatabase()
+        env = Environment(shell, db)
+
+        errors = env.load_modules_by_name(list(module_names), force)
+        if (len(errors) != 0):
+            raise errors[0]
+
+        env.shutdown()
+        db.save_indexes()
+
+        return shell.environment_delta()
+
+    return with_environ(base_environ, load)
@@ -0,0 +1,90 @@
+# -*- Mode: Python -*-
+
+import os
+
+
+# return the per-user cache directory (optionally a subdirectory of it), creating it if
+# necessary.  PYENV_CACHE_DIR overrides the location; setting it to an empty string
+# disables on-disk caching altogether, in which case None is returned.  None is also
+# returned if the directory cannot be created.
+def cache_directory(*subdirs):
+    cache_dir = os.getenv("PYENV_CACHE_DIR")
+    if (cache_dir is None):
+        xdg_cache_home = os.getenv("XDG_CACHE_HOME")
+        if (not xdg_cache_home):
+            xdg_cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(xdg_cache_home, "pyenv")
+    elif (cache_dir == ""):
+        return None
+
+    path = os.path.join(cache_dir, *subdirs)
+    if (not os.path.isdir(path)):
+        try:
+            os.makedirs(path, 0o700)
+        except OSError:
+            if (not os.path.isdir(path)):
+                return None
+
+    return path
+
+
+# a tag identifying the running interpreter, for caches whose contents (marshalled code,
+# parse results) depend on it.
+def interpreter_tag():
+    import sys
+
+    try:
+        implementation = sys.implementation.name
+    except AttributeError:
+        implementation = "python"
+
+    return "%s-%d%d" % (implementation, sys.version_info[0], sys.version_info[1])
+
+
+# generate a filesystem-safe key from an arbitrary set of strings.
+def cache_key(*parts):
+    import hashlib
+
+    return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+# read a pickled object from a cache file.  any failure (missing file, truncated file,
+# incompatible pickle) results in None.
+def load_pickle(path):
+    import pickle
+
+    try:
+        with open(path, "rb") as fh:
+            return pickle.load(fh)
+    except Exception:
+        return None
+
+
+# atomically replace a cache file with the bytes in data.  readers either see the old
+# file or the new one, never a partially written one.  failures are silently ignored;
+# a cache that cannot be written is simply not a cache.
+def atomic_write(path, data):
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            while (len(data) != 0):
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        return False
+
+    return True
+
+
+# atomically pickle an object into a cache file.
+def dump_pickle(path, obj):
+    import pickle
+
+    return atomic_write(path, pickle.dumps(obj, 2))
@@ -0,0 +1,102 @@
+# -*- Mode: Python -*-
+
+import sys
+
+from . import options
+from . import output
+from .actions import Actions
+from .errors import *
+from .profiling import Profiler
+from .statcache import StatCache
+from .timings import Timings
+
+# run one modulecmd invocation with the given arguments (excluding the program name) and
+# return the list of commands for the shell to execute.  mdb may be passed in to reuse a
+# module database across invocations.  raises OptionParsingError if the arguments do not
+# parse, or if nothing should be executed.
+def worker(args, mdb = None):
+    from .shell import shell_mapper
+
+    timings = Timings.get_timings()
+    all_actions = Actions.get_all_actions()
+
+    try:
+        with timings.phase("parse options"):
+            options.TopLevelOptions.parse(args, all_actions, list(shell_mapper.keys()))
+    except OptionParsingError as e:
+        # no shell at this point, so we've already dumped everything to stderr.  just reraise.
+        raise
+
+    try:
+        output.check_output_mode(output.output_mode(options.TopLevelOptions.output))
+    except ValueError as e:
+        sys.stderr.write("%s\n" % e)
+        raise OptionParsingError(str(e))
+
+    Profiler.configure(options.TopLevelOptions.profile, options.TopLevelOptions.profile_dir)
+
+    action_requested = options.TopLevelOptions.action
+    action_arguments = options.TopLevelOptions.action_options
+
+    assert(action_requested in all_actions)
+    action_processor = all_actions[action_requested]
+
+    # figure out which shell...
+    with timings.phase("read environment"):
+        shell = shell_mapper[options.TopLevelOptions.shell](options.TopLevelOptions)
+
+        # ...and, unless the action only looks at the state, set up the module database
+        # and the environment.
+        env = None
+        if (action_requested not in Actions.STATE_ONLY_ACTIONS):
+            from .db import ModuleDatabase
+            from .environment import Environment
+
+            if (mdb is None):
+                mdb = ModuleDatabase()
+
+            try:
+                env = Environment(shell, mdb)
+            except SessionStateError as e:
+                sys.stderr.write("%s\n" % e)
+                raise OptionParsingError(str(e))
+
+    try:
+        with timings.phase("action: %s" % action_requested):
+            action_processor(action_requested, action_arguments, env, shell, mdb)
+    except OptionParsingError as e:
+        # we have a shell, so just clean up normally.
+        pass
+    except SessionStateError as e:
+        sys.stderr.write("%s\n" % e)
+        raise OptionParsingError(str(e))
+
+    with timings.phase("shutdown"):
+        if (env is not None):
+            env.shutdown()
+        if (mdb is not None):
+            mdb.save_indexes()
+        StatCache.get_cache().flush()
+
+    wlog = WarningLog.get_logger()
+
+    for log_msg in wlog.get_log():
+        shell.write("%s" % log_msg)
+
+    with timings.phase("dump state"):
+        shell_state = shell.dump_state()
+
+    if (options.TopLevelOptions.timings):
+        timings.write_report()
+    if (options.TopLevelOptions.timings_file is not None):
+        timings.write_json(options.TopLevelOptions.timings_file)
+    Profiler.get_profiler().write()
+
+    if (options.TopLevelOptions.dump or options.TopLevelOptions.dry_run):
+        sys.stderr.write("\n".join(shell_state) + "\n")
+
+    if (options.TopLevelOptions.dry_run):
+        raise OptionParsingError("not really an error, we just don't want to execute "
+                                 "a dry run")
+
+    return shell_state
@@ -4,10 +4,53 @@ import os
 import sys
 
 from .errors import *
+from .profiling import Profiler
+from .timings import Timings
+
+# a pattern selecting modules by name.  a glob (e.g., "compilers.g*") is matched against
+# the whole module name.  anything else is a prefix: "compilers.gcc" selects the module
+# compilers.gcc and every module under it, such as compilers.gcc.12.
+class ModulePattern(object):
+    GLOB_CHARACTERS = "*?["
+
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+        glob_start = min([pattern.find(character)
+                          for character in ModulePattern.GLOB_CHARACTERS
+                          if character in pattern] + [len(pattern)])
+        self.is_glob = (glob_start != len(pattern))
+
+        # the directory tree all the matching modules are in.  for a glob, these are the
+        # components of the literal part before the first wildcard that are complete.
+        if (self.is_glob):
+            self.subtree = tuple(pattern[:glob_start].split(".")[:-1])
+        else:
+            self.pattern = pattern.rstrip(".")
+            self.subtree = tuple(self.pattern.split(".")) if self.pattern else ()
+
+
+    def matches(self, module_name):
+        if (self.is_glob):
+            import fnmatch
+            return fnmatch.fnmatchcase(module_name, self.pattern)
+
+        return (self.pattern == "" or
+                module_name == self.pattern or
+                module_name.startswith(self.pattern + "."))
+
 
 # recursively find all the py modules in this directory.
 class ModuleDatabase(object):
-    def __init__(self):
+    # the minimum number of threads used to prefetch modulefiles.
+    FETCH_THREADS = 4
+
+
+    # scan_threads sets the number of threads used to scan the module database.  if it is
+    # not specified, PYENV_SCAN_THREADS is consulted.  anything less than 2 scans the
+    # database serially.
+    def __init__(self, scan_threads = None):
         identity = os.path.abspath(__file__)
         self.module_db_path = []
 
@@ -20,25 +63,67 @@ class ModuleDatabase(object):
             pyenv_root = os.path.dirname(os.path.dirname(identity))
             self.module_db_path = [os.path.join(pyenv_root, "modules")]
 
+        if (scan_threads is None):
+            try:
+                scan_threads = int(os.getenv("PYENV_SCAN_THREADS", "1"))
+            except ValueError:
+                scan_threads = 1
+        self.scan_threads = scan_threads
+
         self.database_cache = dict()
+        self.indexes = dict()
+        self.loader = None
+
+        # maps a tuple of (root, relpath) to a frozenset of the .py files in that directory,
+        # or None if there is no such directory.
+        self.listings = dict()
+
+        # module names that no root provides.
+        self.missing_modules = set()
 
 
     def reset_db_cache(self):
         self.database_cache = dict()
+        self.listings = dict()
+        self.missing_modules = set()
 
 
-    # populate the db cache.  if filter is callable, then it is called with the module
-    # name.  if that function returns False, then it is not added to the db cache.
-    def populate_db_cache(self, filter = None):
-        for path in self.module_db_path:
-            path = os.path.abspath(path)
-            for root, dirs, files in os.walk(path, followlinks = True):
-                for name in files:
-                    # only .py files.
-                    if (not name.lower().endswith(".py")):
-                        continue
+    # return the persistent index for a module database root, loading it on first use.
+    def get_index(self, path):
+        from .index import ModuleIndex
 
-                    module_fullpath = os.path.abspath(os.path.join(root, name))
+        if (path not in self.indexes):
+            self.indexes[path] = ModuleIndex(path)
+
+        return self.indexes[path]
+
+
+    # scan the module database and return, for each directory, a sorted list of the names
+    # of the modules in it, as (module name, root number, path) tuples.  the directories of
+    # the first root in PYENV_PATH come first, then those of the second root, and so on.
+    # the directory structure comes from the persistent index, so only directories that
+    # have changed since the last scan are actually read.  with scan_threads > 1, all the
+    # roots are scanned concurrently.  if subtree is given, only the modules under that
+    # tuple of name components are scanned.
+    def scan_listings(self, subtree = ()):
+        from .index import refresh_indexes
+
+        paths = [os.path.abspath(path) for path in self.module_db_path]
+        indexes = [self.get_index(path) for path in paths]
+
+        with Timings.get_timings().phase("scan module database"):
+            scan_results = refresh_indexes(indexes, self.scan_threads, subtree)
+
+        listings = []
+        for root_no, (path, index, scan_result) in enumerate(zip(paths, indexes,
+                                                                 scan_results)):
+            for relpath, files in scan_result:
+                # the scan has just listed these directories; find_module can use them.
+                self.listings[(path, relpath)] = frozenset(files)
+
+                listing = []
+                for name in files:
+                    module_fullpath = os.path.join(path, *(relpath + (name,)))
 
                     # skip over files that have multiple .s, since the splitting won't
                     # work properly.
@@ -48,80 +133,265 @@ class ModuleDatabase(object):
                                "in its filename" % (module_fullpath))
                         continue
 
-                    stripped_path = module_fullpath[len(path) + 1:-3]
+                    listing.append(('.'.join(relpath + (name[:-3],)), root_no,
+                                    module_fullpath))
 
-                    splitted = list()
-                    while (True):
-                        split = os.path.split(stripped_path)
-                        if (split[1] == ""):
-                            break
-                        splitted.append(split[1])
-                        stripped_path = split[0]
-                    splitted.reverse()
+                # the files are sorted by filename, which is not quite the order of the
+                # module names ("a-b.py" comes before "a.py").
+                listing.sort()
+                listings.append(listing)
 
-                    module_name = '.'.join(splitted)
+            index.save()
 
-                    # already exists, keep going.
-                    if (module_name in self.database_cache):
-                        continue
+        return listings
 
-                    # apply the filter.
-                    if (callable(filter) and
-                        filter(module_name) == False):
-                        continue
 
-                    self.database_cache[module_name] = module_fullpath
+    # scan the module database and return a list of (module name, path) tuples for every
+    # modulefile found, in PYENV_PATH order.  a module name may appear more than once if
+    # several roots provide it.  see scan_listings.
+    def scan_modules(self, subtree = ()):
+        return [(module_name, module_fullpath)
+                for listing in self.scan_listings(subtree)
+                for module_name, root_no, module_fullpath in listing]
+
+
+    # populate the db cache.  if filter is callable, then it is called with the module
+    # name.  if that function returns False, then it is not added to the db cache.  the
+    # first root in PYENV_PATH to provide a module name wins.
+    def populate_db_cache(self, filter = None):
+        for module_name, module_fullpath in self.scan_modules():
+            # already exists, keep going.
+            if (module_name in self.database_cache):
+                continue
+
+            # apply the filter.
+            if (callable(filter) and
+                filter(module_name) == False):
+                continue
+
+            self.database_cache[module_name] = module_fullpath
+
+
+    # return the .py files in the directory relpath of the root path, or None if there is
+    # no such directory.  each directory is looked at once per invocation, and only listed
+    # if the index has no up-to-date listing of it.  force looks again.
+    def list_directory(self, path, relpath, force = False):
+        listing_key = (path, relpath)
+        if (force or
+            listing_key not in self.listings):
+            st, entry = self.get_index(path).refresh_directory(relpath)
+            self.listings[listing_key] = None if entry is None else frozenset(entry[2])
+
+        return self.listings[listing_key]
 
 
-    def find_module(self, module_name):
-        if (module_name in self.database_cache):
+    # return the absolute path of the modulefile for a module, or None if no root provides
+    # it.  like the paths the scans find, it is built from the absolute path of the root,
+    # even if PYENV_PATH has a relative one.  lookups are answered from the directory
+    # listings, and both hits and misses are remembered for the rest of the invocation.
+    # force forgets what is known about the module and looks for it again.
+    def find_module(self, module_name, force = False):
+        if (force):
+            self.database_cache.pop(module_name, None)
+            self.missing_modules.discard(module_name)
+        elif (module_name in self.database_cache):
             return self.database_cache[module_name]
+        elif (module_name in self.missing_modules):
+            return None
 
-        module_relpath = "%s%s" % (os.path.join(*module_name.split(".")),
-                                   ".py")
+        module_parts = module_name.split(".")
+        module_relpath = "%s%s" % (os.path.join(*module_parts), ".py")
+        module_filename = "%s.py" % module_parts[-1]
 
         for path in self.module_db_path:
-            module_fullpath = os.path.join(path, module_relpath)
-            if (os.access(module_fullpath, os.F_OK)):
+            path = os.path.abspath(path)
+            files = self.list_directory(path, tuple(module_parts[:-1]), force)
+            if (files is not None and
+                module_filename in files):
+                module_fullpath = os.path.join(path, module_relpath)
                 self.database_cache[module_name] = module_fullpath
                 return module_fullpath
 
+        self.missing_modules.add(module_name)
         return None
 
 
+    # return the static metadata of a module (see pyenv.metadata), or None if the module
+    # cannot be found or its modulefile cannot be parsed.  the modulefile is parsed, never
+    # executed, and the result is kept in the index of the root it was found in.
+    def get_metadata(self, module_name):
+        module_fullpath = self.find_module(module_name)
+        if (module_fullpath is None):
+            return None
+
+        module_parts = module_name.split(".")
+        module_relpath = "%s%s" % (os.path.join(*module_parts), ".py")
+        for path in self.module_db_path:
+            path = os.path.abspath(path)
+            if (os.path.join(path, module_relpath) == module_fullpath):
+                index = self.get_index(path)
+                return index.get_metadata(tuple(module_parts[:-1]),
+                                          "%s.py" % module_parts[-1])
+
+        return None
+
+
+    # write any indexes that have changed back to disk.
+    def save_indexes(self):
+        for index in self.indexes.values():
+            index.save()
+
+
+    # return the loader used to execute modulefiles, creating it on first use.
+    def get_loader(self):
+        if (self.loader is None):
+            from .loader import ModuleLoader
+            self.loader = ModuleLoader()
+
+        return self.loader
+
+
     # this actually loads the module code.  this does *not* execute the module load code.
     def load_module(self, module_name):
         module_path = self.find_module(module_name)
-        short_module_name = module_name.split(".")[-1]
-
-        old_sys_path = sys.path[:]
-        try:
-            sys.path.insert(0, os.path.dirname(module_path))
-            module = __import__(short_module_name)
-            if module_name != short_module_name:
-                sys.modules[module_name] = sys.modules[short_module_name]
-                del sys.modules[short_module_name]
-        finally:
-            sys.path = old_sys_path
+        with Timings.get_timings().module_step(module_name, "import"):
+            with Profiler.get_profiler().module_call(module_name, "import"):
+                module = self.get_loader().load(module_name, module_path)
 
         return module.Module(module_name)
 
 
-    # this retrieves all modules.  if check_syntax is set to True, then we check that the
-    # modules parse correctly and only return those that do.
-    def get_all_modules(self, check_syntax = False):
-        if (check_syntax):
-            def filter(module_name):
-                try:
-                    self.load_module(module_name)
-                except:
-                    return False
+    # find and compile a set of modulefiles concurrently, so that loading them afterwards
+    # does not wait on the filesystem one file at a time.  failures are ignored here; they
+    # surface when the modules are actually loaded.
+    def prefetch(self, module_names):
+        from .threads import parallel_map
 
-                return True
+        loader = self.get_loader()
 
-            self.reset_db_cache()
-            self.populate_db_cache(filter)
+        def fetch(module_name):
+            try:
+                module_path = self.find_module(module_name)
+                if (module_path is not None):
+                    loader.get_code(module_path)
+            except Exception:
+                pass
+
+        parallel_map(fetch, module_names, max(self.scan_threads, ModuleDatabase.FETCH_THREADS))
+
+
+    # returns sorted lists of (module name, root number, path) tuples, one per directory
+    # scanned (see scan_listings), of the modules that match any of the patterns (see
+    # ModulePattern), or of all the modules if there are none.  only the directory trees
+    # the patterns can match in are scanned.
+    def module_listings(self, patterns = None):
+        if (not patterns):
+            return self.scan_listings()
+
+        matchers = [ModulePattern(pattern) for pattern in patterns]
+
+        # scan each distinct subtree once, skipping those inside another one.
+        subtrees = set([matcher.subtree for matcher in matchers])
+        subtrees = sorted([subtree
+                           for subtree in subtrees
+                           if not any([subtree[:ix] in subtrees
+                                       for ix in range(len(subtree))])])
+
+        # a prefix also matches the module it names, which lives next to its subtree, in
+        # any of the roots.
+        listings = []
+        for matcher in matchers:
+            if (matcher.is_glob or
+                any([matcher.subtree[:ix] in subtrees
+                     for ix in range(len(matcher.subtree))])):
+                continue
+
+            module_parts = matcher.pattern.split(".")
+            module_filename = "%s.py" % module_parts[-1]
+            listing = []
+            for root_no, path in enumerate(self.module_db_path):
+                path = os.path.abspath(path)
+                files = self.list_directory(path, tuple(module_parts[:-1]))
+                if (files is not None and
+                    module_filename in files):
+                    listing.append((matcher.pattern, root_no,
+                                    os.path.join(path, *(module_parts[:-1] +
+                                                         [module_filename]))))
+            listings.append(listing)
+
+        for subtree in subtrees:
+            for listing in self.scan_listings(subtree):
+                listings.append([entry
+                                 for entry in listing
+                                 if any([matcher.matches(entry[0])
+                                         for matcher in matchers])])
+
+        return listings
+
+
+    # merge sorted listings of (module name, root number, path) tuples into one sorted
+    # sequence of (module name, path) tuples, with only the first root to provide each
+    # module name.  this is a generator, so the merged listing is never built.
+    @staticmethod
+    def merge_listings(listings):
+        import heapq
+
+        previous_name = None
+        for module_name, root_no, module_fullpath in heapq.merge(*listings):
+            if (module_name != previous_name):
+                previous_name = module_name
+                yield (module_name, module_fullpath)
+
+
+    # generate the names of all modules, or with patterns, just the modules that match any
+    # of them, in sorted order.  the database is scanned right away, but the names are only
+    # produced, from the sorted listing of each directory, as they are consumed (e.g., by
+    # Shell.write_bulk), so a large listing is never held in memory as a whole.
+    def iter_all_modules(self, patterns = None):
+        listings = self.module_listings(patterns)
+
+        def generate():
+            for module_name, module_fullpath in ModuleDatabase.merge_listings(listings):
+                if (module_name not in self.database_cache):
+                    self.database_cache[module_name] = module_fullpath
+                yield module_name
+
+        return generate()
+
+
+    # this retrieves all modules, or with patterns, just the modules that match any of
+    # them (see ModulePattern), as a sorted list of names.  only the directory trees the
+    # patterns can match in are scanned.  if check_syntax is set to True, then we check that
+    # the modules parse correctly and define a Module class, and only return those that
+    # do.  the modulefiles are parsed in a process pool and never executed.
+    def get_all_modules(self, check_syntax = False, patterns = None):
+        if (not check_syntax):
+            return list(self.iter_all_modules(patterns))
+
+        import heapq
+
+        from .validate import SyntaxValidator
+
+        # every root's modulefile for a module name is checked, sorted by name and then by
+        # root.  the first root to provide a valid one wins, so an invalid modulefile does
+        # not hide a valid one further down PYENV_PATH.
+        candidates = list(heapq.merge(*self.module_listings(patterns)))
+
+        valid = SyntaxValidator().validate([module_fullpath
+                                            for module_name, root_no, module_fullpath
+                                            in candidates])
+
+        if (patterns):
+            for module_name, root_no, module_fullpath in candidates:
+                self.database_cache.pop(module_name, None)
         else:
-            self.populate_db_cache()
+            self.reset_db_cache()
+
+        module_names = []
+        for module_name, root_no, module_fullpath in candidates:
+            if (valid[module_fullpath] and
+                module_name not in self.database_cache):
+                module_names.append(module_name)
+                self.database_cache[module_name] = module_fullpath
 
-        return self.database_cache.keys()
+        return module_names
@@ -0,0 +1,97 @@
+# -*- Mode: Python -*-
+
+# the dependency graph between loaded modules.  edges are kept in both directions, so
+# adding, removing or querying the edges of a module only touches that module's own edges.
+class DependencyGraph(object):
+    def __init__(self):
+        # maps a module to the set of modules it depends on.
+        self.dependencies = dict()
+
+        # maps a module to the set of modules that depend on it.
+        self.dependents = dict()
+
+
+    # build a graph from a mapping of each module to the set of modules that depend on it.
+    @classmethod
+    def from_dependents(cls, dependents):
+        graph = cls()
+        for dependency, dependent_set in dependents.items():
+            for dependent in dependent_set:
+                graph.add_edge(dependent, dependency)
+
+        return graph
+
+
+    # record that module_name depends on dependency.
+    def add_edge(self, module_name, dependency):
+        self.dependencies.setdefault(module_name, set()).add(dependency)
+        self.dependents.setdefault(dependency, set()).add(module_name)
+
+
+    def remove_edge(self, module_name, dependency):
+        DependencyGraph.discard(self.dependencies, module_name, dependency)
+        DependencyGraph.discard(self.dependents, dependency, module_name)
+
+
+    # remove value from mapping[key], dropping the key once its set is empty.
+    @staticmethod
+    def discard(mapping, key, value):
+        value_set = mapping.get(key)
+        if (value_set is None):
+            return
+
+        value_set.discard(value)
+        if (len(value_set) == 0):
+            del mapping[key]
+
+
+    def get_dependencies(self, module_name):
+        return self.dependencies.get(module_name, frozenset())
+
+
+    def get_dependents(self, module_name):
+        return self.dependents.get(module_name, frozenset())
+
+
+    # remove a module and all of its edges.
+    def remove_module(self, module_name):
+        for dependency in self.dependencies.pop(module_name, ()):
+            DependencyGraph.discard(self.dependents, dependency, module_name)
+        for dependent in self.dependents.pop(module_name, ()):
+            DependencyGraph.discard(self.dependencies, dependent, module_name)
+
+
+    # order a set of modules so that every module comes before the modules it depends on,
+    # i.e., a safe order to unload them in.  modules caught in a cycle go last, sorted by
+    # name.
+    def unload_order(self, module_names):
+        module_names = set(module_names)
+
+        # for each module, the number of its dependents that are also being ordered.
+        blocking = dict([(module_name,
+                          len(self.get_dependents(module_name) & module_names))
+                         for module_name in module_names])
+
+        ready = sorted([module_name
+                        for module_name, count in blocking.items()
+                        if count == 0],
+                       reverse = True)
+        order = []
+        while (len(ready) != 0):
+            module_name = ready.pop()
+            order.append(module_name)
+
+            for dependency in sorted(self.get_dependencies(module_name)):
+                if (dependency not in blocking):
+                    continue
+                blocking[dependency] = blocking[dependency] - 1
+                if (blocking[dependency] == 0):
+                    ready.append(dependency)
+
+        if (len(order) != len(module_names)):
+            ordered = set(order)
+            order.extend(sorted([module_name
+                                 for module_name in module_names
+                                 if module_name not in ordered]))
+
+        return order
@@ -2,75 +2,300 @@
 
 import sys
 from .errors import *
+from .depgraph import DependencyGraph
+from .profiling import Profiler
+from .timings import Timings
 
 class Environment(object):
     def __init__(self, shell, db):
         import os
-        import pickle
-        import base64
+        from . import state
 
         # save the shell and the db
         self.shell = shell
         self.db = db
 
-        ix = 0
-        env_directory = []
-        while (True):
-            env_name = "PYENV_DATA_%d" % ix
-            st = os.getenv(env_name)
-            if (st is None):
-                break
-
-            env_directory.append(st)
-            ix = ix + 1
-
-        if (ix != 0):
-            try:
-                env_str = ''.join(env_directory)
-                env_str_decoded = base64.b64decode(env_str)
-                self.loaded_modules, self.dependencies = pickle.loads(env_str_decoded)
-            except Exception as ex:
-                sys.stderr.write("Unable to decode prior environment ({}); discarding.\n".format(ex))
-                ix = 0
-
-        if (ix == 0):
-            # no prior setup or a corrupted setup.  initialize defaults.
-
-            # this is a set of modules.  straightforward, yes?
-            self.loaded_modules = set()
-
-            # this is a dictionary of modules and their dependencies.
-            self.dependencies = {}
-
-        self.cleanup_range = ix
-        self.need_env_dump = False
+        # legacy and chunked state lives in PYENV_DATA_<n>; session state lives in a file
+        # named by PYENV_SESSION.  with no prior setup (or a corrupted one), nothing is
+        # loaded.
+        self.use_session = state.use_sessions(os.environ)
+        self.had_session = (os.getenv(state.SESSION_VARIABLE) is not None)
+
+        # this is a set of modules, and the dependency graph between them.
+        self.loaded_modules, dependents, self.cleanup_range = state.read_state(os.environ)
+        self.graph = DependencyGraph.from_dependents(dependents)
+
+        # switching to session mode moves the state out of PYENV_DATA_<n> right away.
+        self.need_env_dump = (self.use_session and self.cleanup_range != 0)
+        self.replay_cache = None
         self.ready = True
 
 
+    # maps each module to the set of loaded modules that depend on it.
+    @property
+    def dependencies(self):
+        return self.graph.dependents
+
+
     # load a module.  may raise ModulePreloadError or ModuleLoadError.  this should
     # generally not be called externally.
     def load_module(self, module):
+        errors = self.load_modules_by_name([module.name()], True, {module.name(): module})
+        if (len(errors) != 0):
+            raise errors[0]
+
+
+    # call the preload, load or unload method of a module, timing it and, if enabled,
+    # profiling it.
+    def call_module(self, module, step, *args):
+        with Timings.get_timings().module_step(module.name(), step):
+            with Profiler.get_profiler().module_call(module.name(), step):
+                return getattr(module, step)(*args)
+
+
+    # raise ModulePreloadError if module_name cannot be loaded alongside the loaded modules,
+    # either because it conflicts with one of them or because one of them is in the same
+    # family.
+    def check_conflicts(self, module_name, conflicts, family):
+        for conflict in conflicts:
+            if (conflict != module_name and
+                conflict in self.loaded_modules):
+                raise ModulePreloadError("Module %s conflicts with loaded module %s" %
+                                         (module_name, conflict))
+
+        if (family is None):
+            return
+
+        for loaded_module in sorted(self.loaded_modules):
+            if (loaded_module == module_name):
+                continue
+
+            metadata = self.db.get_metadata(loaded_module)
+            if (metadata is not None and
+                metadata["family"] == family):
+                raise ModulePreloadError("Module %s conflicts with loaded module %s "
+                                         "(family %s)" %
+                                         (module_name, loaded_module, family))
+
+
+    # resolve the dependency closure of a list of modules.  modules that declare their
+    # dependencies statically are planned from their metadata alone.  the others are
+    # fetched and compiled concurrently, one level of the dependency graph at a time, and
+    # preloaded to find their dependencies.  modules may map module names to already
+    # instantiated modules.  returns a tuple of a dict mapping each module to be loaded to
+    # a tuple of (module, dependencies), and a dict mapping modules that could not be
+    # resolved to the error that occurred.  the module is None if it has not been
+    # instantiated yet.  if plan and failures are given, they are extended and returned.
+    def resolve_dependencies(self, module_names, modules = None, plan = None,
+                             failures = None):
+        if (modules is None):
+            modules = dict()
+        if (plan is None):
+            plan = dict()
+        if (failures is None):
+            failures = dict()
+
+        wave = list(module_names)
+        while (len(wave) != 0):
+            wave_metadata = dict([(module_name, self.db.get_metadata(module_name))
+                                  for module_name in wave
+                                  if module_name not in modules])
+            self.db.prefetch([module_name
+                              for module_name, metadata in wave_metadata.items()
+                              if metadata is None or not metadata["static"]])
+
+            next_wave = []
+            for module_name in wave:
+                if (module_name in plan or
+                    module_name in failures):
+                    continue
+
+                try:
+                    metadata = wave_metadata.get(module_name)
+                    if (module_name in modules):
+                        module = modules[module_name]
+                        dependencies = list(self.call_module(module, "preload", self))
+                    elif (metadata is not None and
+                          metadata["static"]):
+                        module = None
+                        self.check_conflicts(module_name,
+                                             metadata["conflicts"], metadata["family"])
+                        dependencies = list(metadata["dependencies"])
+                    elif (self.db.find_module(module_name)):
+                        module = self.db.load_module(module_name)
+                        dependencies = list(self.call_module(module, "preload", self))
+                    else:
+                        raise ModuleLoadError("Cannot find module %s" % module_name)
+                except ModuleError as e:
+                    failures[module_name] = e
+                    continue
+
+                plan[module_name] = (module, dependencies)
+                next_wave.extend([dependency
+                                  for dependency in dependencies
+                                  if (dependency not in self.loaded_modules and
+                                      dependency not in plan and
+                                      dependency not in failures)])
+
+            wave = next_wave
+
+        return (plan, failures)
+
+
+    # append module_name, preceded by whatever it depends on that isn't loaded yet, to
+    # order.  raises the resolution error of any module involved, or ModuleLoadError if
+    # the dependencies form a cycle.
+    def order_dependencies(self, module_name, plan, failures, order, ordered, path):
+        if (module_name in ordered):
+            return
+        if (module_name in failures):
+            raise failures[module_name]
+        if (module_name in path):
+            cycle = path[path.index(module_name):] + [module_name]
+            raise ModuleLoadError("Dependency cycle: %s" % " -> ".join(cycle))
+
+        path.append(module_name)
+        for dependency in plan[module_name][1]:
+            if (dependency not in self.loaded_modules):
+                self.order_dependencies(dependency, plan, failures, order, ordered, path)
+        path.pop()
+
+        ordered.add(module_name)
+        order.append(module_name)
+
+
+    # load several modules at once.  the dependency closure of all the requested modules is
+    # resolved up front, then the modules are loaded in dependency order as a single
+    # transaction: if any of them fails to load, the shell and the environment are rolled
+    # back and none of them stay loaded.  requests that cannot be satisfied (missing
+    # modules, preload errors, conflicts, dependency cycles) are dropped before anything is
+    # loaded.  the requests are resolved in order, and the modules of the requests before a
+    # request count as loaded while it is resolved, just as if the requests had been loaded
+    # one after the other.  returns a list of errors describing the requests that were not
+    # loaded.
+    def load_modules_by_name(self, module_names, force = False, modules = None):
         assert(self.ready == True)
 
-        module_name = module.name()
+        errors = []
+        requested = []
+        for module_name in module_names:
+            if (force == False and
+                module_name in self.loaded_modules):
+                errors.append(ModuleLoadError("Module %s already loaded" % module_name))
+            elif (module_name not in requested):
+                requested.append(module_name)
+
+                # a forced load looks for the modulefile again, rather than trusting what
+                # the database remembers.
+                if (force and
+                    (modules is None or module_name not in modules)):
+                    self.db.find_module(module_name, True)
+
+        profiler = Profiler.get_profiler()
+
+        # the modules to load for each request, in order.
+        plan = dict()
+        failures = dict()
+        request_orders = []
+        ordered = set()
+        loading = []
+        loaded_modules = self.loaded_modules
+        try:
+            for module_name in requested:
+                # preload and check_conflicts see the modules of the earlier requests as
+                # loaded.
+                self.loaded_modules = loaded_modules | ordered
+
+                planned = set(plan.keys())
+                with profiler.span("resolve %s" % module_name, "resolve"):
+                    self.resolve_dependencies([module_name], modules, plan, failures)
+
+                request_order = []
+                request_ordered = set(ordered)
+                try:
+                    self.order_dependencies(module_name, plan, failures,
+                                            request_order, request_ordered, [])
+                except ModuleError as e:
+                    errors.append(e)
+
+                    # what was planned for this request alone was planned alongside
+                    # modules that won't be loaded.
+                    for planned_name in set(plan.keys()) - planned:
+                        del plan[planned_name]
+                else:
+                    request_orders.append((module_name, request_order))
+                    ordered = request_ordered
+                    loading.append(module_name)
+        finally:
+            self.loaded_modules = loaded_modules
+
+        if (len(request_orders) == 0):
+            return errors
+
+        # preload has already happened; now load.
+        self.shell.push()
+        newly_loaded = []
+        new_edges = []
+        try:
+            for requested_name, request_order in request_orders:
+                with profiler.span("request %s" % requested_name, "request"):
+                    for module_name in request_order:
+                        module, dependencies = plan[module_name]
+                        if (module is None):
+                            self.load_planned_module(module_name)
+                        else:
+                            self.call_module(module, "load", self, self.shell)
+
+                        # update the loaded modules and the dependency graph.
+                        if (module_name not in self.loaded_modules):
+                            self.loaded_modules.add(module_name)
+                            newly_loaded.append(module_name)
+                        for dependency in dependencies:
+                            if (dependency not in self.graph.get_dependencies(module_name)):
+                                self.graph.add_edge(module_name, dependency)
+                                new_edges.append((module_name, dependency))
+        except ModuleError as e:
+            self.shell.pop()
+            for module_name in newly_loaded:
+                self.loaded_modules.remove(module_name)
+            for module_name, dependency in new_edges:
+                self.graph.remove_edge(module_name, dependency)
+
+            errors.append(ModuleLoadError("%s; not loading %s" % (e, ", ".join(loading))))
+            return errors
+
+        self.shell.commit()
+        self.need_env_dump = True
+        return errors
 
-        # preload, then load.
-        dependencies = module.preload(self)
-        for dependency in dependencies:
-            if (dependency not in self.loaded_modules):
-                self.load_module_by_name(dependency)
 
-            if (dependency not in self.dependencies):
-                self.dependencies[dependency] = set()
+    # load a module that was planned from its static metadata alone.  with the replay cache
+    # enabled, the shell operations the module performed the last time it was loaded under
+    # the same conditions are replayed instead of importing and running the modulefile.
+    def load_planned_module(self, module_name):
+        from .replay import ReplayCache
 
-            self.dependencies[dependency].add(module_name)
+        if (not ReplayCache.enabled()):
+            self.call_module(self.db.load_module(module_name), "load", self, self.shell)
+            return
 
-        module.load(self, self.shell)
+        if (self.replay_cache is None):
+            self.replay_cache = ReplayCache()
 
-        # update the loaded modules and the dependency graph.
-        self.loaded_modules.add(module_name)
+        module_path = self.db.find_module(module_name)
+        op_log = self.replay_cache.lookup(module_path)
+        if (op_log is not None):
+            with Timings.get_timings().module_step(module_name, "replay"):
+                with Profiler.get_profiler().span("replay %s" % module_name, "replay"):
+                    self.shell.replay(op_log)
+            return
 
-        self.need_env_dump = True
+        def load(env, shell):
+            module = self.db.load_module(module_name)
+            self.call_module(module, "load", env, shell)
+            return module
+
+        self.replay_cache.record(module_path, self, self.shell, load)
 
 
     # unload a module from the loaded set.  raise ModuleUnloadError if we can't unload the
@@ -81,47 +306,34 @@ class Environment(object):
         # does this module have any dependencies?
         module_name = module.name()
 
-        if (module_name in self.dependencies and
-            len(self.dependencies[module_name]) != 0):
+        dependents = self.graph.get_dependents(module_name)
+        if (len(dependents) != 0):
             raise ModuleUnloadError("the following modules (%s) still depend on %s" %
-                                    (", ".join(self.dependencies[module_name]),
+                                    (", ".join(sorted(dependents)),
                                      module_name))
 
         # clear and ready to go.
-        module.unload(self, self.shell)
+        self.call_module(module, "unload", self, self.shell)
         self.loaded_modules.remove(module_name)
-        if (module_name in self.dependencies):
-            del self.dependencies[module_name]
-
-        for dependency_name, dependency_set in self.dependencies.items():
-            if (module_name in dependency_set):
-                dependency_set.remove(module_name)
-            if (len(dependency_set) == 0):
-                del self.dependencies[dependency_name]
+        self.graph.remove_module(module_name)
 
         self.need_env_dump = True
 
 
     # load a module by name.  may raise ModuleLoadError.
     def load_module_by_name(self, module_name, force=False):
-        if (force == False and
-            module_name in self.loaded_modules):
-            raise ModuleLoadError("Module %s already loaded" % module_name)
-        elif (self.db.find_module(module_name)):
-            module = self.db.load_module(module_name)
-            self.load_module(module)
-        else:
-            raise ModuleLoadError("Cannot find module %s" % module_name)
+        errors = self.load_modules_by_name([module_name], force)
+        if (len(errors) != 0):
+            raise errors[0]
 
 
     # unload a module from the loaded set.  may raise ModuleNotLoadedError.
     def unload_module_by_name(self, module_name):
         if (module_name not in self.loaded_modules):
             raise ModuleUnloadError("Module %s not loaded" % module_name)
-        elif (module_name in self.dependencies and
-              len(self.dependencies[module_name]) != 0):
+        elif (len(self.graph.get_dependents(module_name)) != 0):
             raise ModuleUnloadError("Module(s) (%s) still depend on %s." %
-                                    (", ".join(self.dependencies[module_name]),
+                                    (", ".join(sorted(self.graph.get_dependents(module_name))),
                                      module_name))
         elif (self.db.find_module(module_name)):
             module = self.db.load_module(module_name)
@@ -134,40 +346,135 @@ class Environment(object):
     def okay_to_unload(self, module_name):
         if (module_name not in self.loaded_modules):
             raise ModuleUnloadError("Module %s not loaded" % module_name)
-        elif (module_name in self.dependencies and
-              len(self.dependencies[module_name]) != 0):
+        elif (len(self.graph.get_dependents(module_name)) != 0):
             return False
         else:
             return True
 
 
-    # swap two modules.  raise ModuleUnloadError if we can't complete the swap.
+    # order a set of modules for unloading, so that each module is unloaded before the
+    # modules it depends on.
+    def unload_order(self, module_names):
+        return self.graph.unload_order(module_names)
+
+
+    # check whether incoming_name can stand in for outgoing_name as a dependency, i.e.,
+    # whether they are in the same family or are siblings in the module tree (e.g.,
+    # compilers.gcc and compilers.intel).
+    def compatible_replacement(self, outgoing_name, incoming_name):
+        outgoing_metadata = self.db.get_metadata(outgoing_name)
+        incoming_metadata = self.db.get_metadata(incoming_name)
+        if (outgoing_metadata is not None and
+            incoming_metadata is not None and
+            outgoing_metadata["family"] is not None and
+            outgoing_metadata["family"] == incoming_metadata["family"]):
+            return True
+
+        outgoing_parts = outgoing_name.split(".")
+        incoming_parts = incoming_name.split(".")
+        return (len(outgoing_parts) > 1 and
+                outgoing_parts[:-1] == incoming_parts[:-1])
+
+
+    # replace the loaded module outgoing_module with incoming_name as a single transaction.
+    # modules that depended on the outgoing module stay loaded and depend on the incoming
+    # module instead, provided it is a compatible replacement.  modules may map module
+    # names to already instantiated modules.  if anything fails, the shell and the
+    # environment are left as they were.
+    def swap_loaded_module(self, outgoing_module, incoming_name, modules = None):
+        assert(self.ready == True)
+
+        outgoing_name = outgoing_module.name()
+        if (outgoing_name not in self.loaded_modules):
+            raise ModuleUnloadError("Module %s not loaded" % outgoing_name)
+        if (incoming_name in self.loaded_modules):
+            raise ModuleLoadError("Module %s already loaded" % incoming_name)
+
+        dependents = set(self.graph.get_dependents(outgoing_name))
+        dependencies = set(self.graph.get_dependencies(outgoing_name))
+        if (len(dependents) != 0 and
+            not self.compatible_replacement(outgoing_name, incoming_name)):
+            raise ModuleUnloadError("Module(s) (%s) still depend on %s, and %s cannot "
+                                    "replace it" %
+                                    (", ".join(sorted(dependents)),
+                                     outgoing_name, incoming_name))
+
+        self.shell.push()
+        try:
+            self.call_module(outgoing_module, "unload", self, self.shell)
+        except ModuleError as e:
+            self.shell.pop()
+            raise ModuleUnloadError("%s; not swapping %s for %s" %
+                                    (e, outgoing_name, incoming_name))
+
+        self.loaded_modules.remove(outgoing_name)
+        self.graph.remove_module(outgoing_name)
+
+        errors = self.load_modules_by_name([incoming_name], False, modules)
+        if (len(errors) != 0):
+            # put everything back the way it was.
+            self.shell.pop()
+            self.loaded_modules.add(outgoing_name)
+            for dependency in dependencies:
+                self.graph.add_edge(outgoing_name, dependency)
+            for dependent in dependents:
+                self.graph.add_edge(dependent, outgoing_name)
+
+            raise ModuleLoadError("%s; not swapping %s for %s" %
+                                  (errors[0], outgoing_name, incoming_name))
+
+        for dependent in dependents:
+            self.graph.add_edge(dependent, incoming_name)
+
+        self.shell.commit()
+        self.need_env_dump = True
+
+
+    # swap two modules.  raise ModuleUnloadError or ModuleLoadError if we can't complete
+    # the swap.
     def swap_module(self, outgoing_module, incoming_module):
-        pass
+        self.swap_loaded_module(outgoing_module, incoming_module.name(),
+                                {incoming_module.name(): incoming_module})
 
 
-    # stop accepting commands and write out our new environment back out to the shell.
-    def shutdown(self, max_chunk_size = 100):
-        import base64
-        import pickle
+    # swap two modules by name.  raise ModuleUnloadError or ModuleLoadError if we can't
+    # complete the swap.
+    def swap_module_by_name(self, outgoing_name, incoming_name):
+        if (outgoing_name not in self.loaded_modules):
+            raise ModuleUnloadError("Module %s not loaded" % outgoing_name)
+        elif (self.db.find_module(outgoing_name)):
+            self.swap_loaded_module(self.db.load_module(outgoing_name), incoming_name)
+        else:
+            raise ModuleUnloadError("Cannot find module %s" % outgoing_name)
 
+
+    # stop accepting commands and write out our new environment back out to the shell.
+    # the state is split across variables of at most max_chunk_size characters; if it is
+    # not specified, PYENV_DATA_CHUNK_SIZE is consulted.
+    def shutdown(self, max_chunk_size = None):
         assert(self.ready == True)
 
         if (self.need_env_dump):
+            from . import state
+
             # clear out the old env
             for ix in range(self.cleanup_range):
-                env_name = "PYENV_DATA_%d" % ix
+                env_name = "%s%d" % (state.DATA_PREFIX, ix)
                 self.shell.remove_env(env_name)
 
-            # pickle the state and write it out to the environment.
-            pickled = pickle.dumps((self.loaded_modules, self.dependencies), 2)
-            encoded = base64.b64encode(pickled).decode("latin-1")
-            chunks = [encoded[ix:ix + max_chunk_size]
-                      for ix in range(0, len(encoded), max_chunk_size)]
-
-            for chunk_no, chunk in enumerate(chunks):
-                self.shell.add_env("PYENV_DATA_%d" % chunk_no, chunk)
+            # encode the state and write it out to the environment, or to a session file
+            # if we can.
+            encoded = state.encode_state(self.loaded_modules, self.graph.dependents)
+            session_token = None
+            if (self.use_session):
+                session_token = state.write_session(encoded)
+
+            if (session_token is not None):
+                self.shell.add_env(state.SESSION_VARIABLE, session_token)
+            else:
+                if (self.had_session):
+                    self.shell.remove_env(state.SESSION_VARIABLE)
+                for env_name, chunk in state.split_chunks(encoded, max_chunk_size):
+                    self.shell.add_env(env_name, chunk)
 
         self.ready = False
-
-
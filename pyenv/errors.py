@@ -45,6 +45,15 @@ class ShellReverseOperationError(Exception):
     pass
 
 
+class ServerError(Exception):
+    pass
+
+
+# raised when the state a shell refers to (see pyenv.state) cannot be recovered.
+class SessionStateError(Exception):
+    pass
+
+
 class Log(object):
     def __init__(self):
         self.__log = []
@@ -67,6 +76,10 @@ class Log(object):
         return self.__log
 
 
+    def clear(self):
+        self.__log = []
+
+
     @classmethod
     def get_logger(cls):
         class_name = cls.__name__
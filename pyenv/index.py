@@ -0,0 +1,243 @@
+# -*- Mode: Python -*-
+
+import os
+import stat
+import time
+
+from . import cache
+from .timings import Timings
+
+# a persistent index of the modulefiles under one module database root.  for every
+# directory under the root, we remember a signature of the directory (mtime, size and
+# inode), its subdirectories and the .py files in it.  refreshing the index only stats
+# each known directory; a directory is listed again only if its signature changed.
+#
+# the index also holds the static metadata of the modulefiles (see pyenv.metadata), so a
+# modulefile is only parsed again when it changes.
+class ModuleIndex(object):
+    VERSION = 2
+
+    # directories modified less than this many seconds before they were listed are not
+    # trusted, since a change within the same mtime tick would otherwise go unnoticed.
+    MTIME_GRACE = 2
+
+
+    def __init__(self, root):
+        self.root = root
+
+        # maps a tuple of path components relative to the root to a tuple of
+        # (signature, subdirectories, files).
+        self.directories = dict()
+
+        # maps a tuple of path components of a modulefile relative to the root to a tuple
+        # of (signature, metadata).
+        self.metadata = dict()
+        self.dirty = False
+
+        self.index_path = None
+        index_dir = cache.cache_directory("index")
+        if (index_dir is not None):
+            self.index_path = os.path.join(index_dir, "%s.pickle" % cache.cache_key(root))
+            stored = cache.load_pickle(self.index_path)
+            if (isinstance(stored, tuple) and
+                len(stored) == 4 and
+                stored[0] == ModuleIndex.VERSION and
+                stored[1] == root):
+                self.directories = stored[2]
+                self.metadata = stored[3]
+
+
+    def directory_path(self, relpath):
+        return os.path.join(self.root, *relpath)
+
+
+    # returns the stat result of a directory (following links), or None if it is not a
+    # directory.
+    def stat_directory(self, relpath):
+        Timings.get_timings().count("stat")
+        try:
+            st = os.stat(self.directory_path(relpath))
+        except OSError:
+            return None
+
+        if (not stat.S_ISDIR(st.st_mode)):
+            return None
+
+        return st
+
+
+    @staticmethod
+    def signature(st):
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+
+    # list a directory, splitting the entries into subdirectories and .py files.  like
+    # os.walk(followlinks = True), symlinks to directories are treated as directories.
+    def list_directory(self, relpath, st, now):
+        Timings.get_timings().count("listdir")
+        dir_path = self.directory_path(relpath)
+        subdirs = []
+        files = []
+
+        try:
+            scandir = os.scandir
+        except AttributeError:
+            scandir = None
+
+        try:
+            if (scandir is not None):
+                for entry in scandir(dir_path):
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if (is_dir):
+                        subdirs.append(entry.name)
+                    elif (entry.name.lower().endswith(".py")):
+                        files.append(entry.name)
+            else:
+                for name in os.listdir(dir_path):
+                    if (os.path.isdir(os.path.join(dir_path, name))):
+                        subdirs.append(name)
+                    elif (name.lower().endswith(".py")):
+                        files.append(name)
+        except OSError:
+            return None
+
+        subdirs.sort()
+        files.sort()
+
+        signature = ModuleIndex.signature(st)
+        if (now - st.st_mtime < ModuleIndex.MTIME_GRACE):
+            signature = None
+
+        return (signature, tuple(subdirs), tuple(files))
+
+
+    # bring a single directory up to date.  returns a tuple of the directory's stat result
+    # and its entry, or (None, None) if the directory no longer exists.
+    def refresh_directory(self, relpath, now = None):
+        st = self.stat_directory(relpath)
+        if (st is None):
+            if (relpath in self.directories):
+                del self.directories[relpath]
+                self.dirty = True
+            return (None, None)
+
+        entry = self.directories.get(relpath)
+        if (entry is None or
+            entry[0] is None or
+            entry[0] != ModuleIndex.signature(st)):
+            entry = self.list_directory(relpath, st, time.time() if now is None else now)
+            if (entry is None):
+                return (None, None)
+            self.directories[relpath] = entry
+            self.dirty = True
+
+        return (st, entry)
+
+
+    # forget about every directory under start that is not in visited, and about the
+    # metadata of every modulefile under start that is no longer there.
+    def prune(self, visited, start = ()):
+        for relpath in list(self.directories.keys()):
+            if (relpath[:len(start)] == start and
+                relpath not in visited):
+                del self.directories[relpath]
+                self.dirty = True
+
+        for file_relpath in list(self.metadata.keys()):
+            if (file_relpath[:len(start)] != start):
+                continue
+            entry = self.directories.get(file_relpath[:-1])
+            if (entry is None or
+                file_relpath[-1] not in entry[2]):
+                del self.metadata[file_relpath]
+                self.dirty = True
+
+
+    # return the static metadata of the modulefile filename in the directory relpath, or
+    # None if the file cannot be parsed.  the modulefile is only parsed if it has changed
+    # since its metadata was last recorded.
+    def get_metadata(self, relpath, filename):
+        file_relpath = relpath + (filename,)
+        Timings.get_timings().count("stat")
+        try:
+            st = os.stat(os.path.join(self.root, *file_relpath))
+        except OSError:
+            return None
+
+        signature = (st.st_mtime, st.st_size)
+        entry = self.metadata.get(file_relpath)
+        if (entry is not None and
+            entry[0] == signature):
+            return entry[1]
+
+        from .metadata import extract_metadata
+
+        Timings.get_timings().count("parse")
+        metadata = extract_metadata(os.path.join(self.root, *file_relpath))
+        if (time.time() - st.st_mtime >= ModuleIndex.MTIME_GRACE):
+            self.metadata[file_relpath] = (signature, metadata)
+            self.dirty = True
+
+        return metadata
+
+
+    # write the index back to disk if it has changed.
+    def save(self):
+        if (self.dirty and
+            self.index_path is not None):
+            cache.dump_pickle(self.index_path,
+                              (ModuleIndex.VERSION, self.root, self.directories,
+                               self.metadata))
+        self.dirty = False
+
+
+# bring several indexes up to date at once.  the directory trees are walked breadth first
+# and, with threads > 1, every directory on a level (across all the indexes) is refreshed
+# concurrently, so the number of round trips to the filesystem grows with the depth of
+# the trees rather than with the number of directories.  if start is given, only the
+# directory tree at that relative path is walked.  returns one list of (relpath, files)
+# tuples per index, in the same order as indexes, each sorted so that parents come before
+# their children.
+def refresh_indexes(indexes, threads = 1, start = ()):
+    from .threads import parallel_map
+
+    now = time.time()
+    results = [[] for index in indexes]
+    visited = [set() for index in indexes]
+
+    def refresh_one(item):
+        index_no, relpath, ancestors = item
+        return indexes[index_no].refresh_directory(relpath, now)
+
+    # each directory carries the (device, inode) pairs of the directories on its path.
+    level = [(index_no, start, ()) for index_no in range(len(indexes))]
+    while (len(level) != 0):
+        refreshed = parallel_map(refresh_one, level, threads)
+
+        next_level = []
+        for (index_no, relpath, ancestors), (st, entry) in zip(level, refreshed):
+            if (entry is None):
+                continue
+
+            visited[index_no].add(relpath)
+
+            # guard against symlink loops, i.e., a directory that is its own ancestor.  a
+            # directory reached through several aliases is listed under each of them.
+            inode = (st.st_dev, st.st_ino)
+            if (inode in ancestors):
+                continue
+
+            results[index_no].append((relpath, entry[2]))
+            next_level.extend([(index_no, relpath + (subdir,), ancestors + (inode,))
+                               for subdir in entry[1]])
+
+        level = next_level
+
+    for index_no, index in enumerate(indexes):
+        index.prune(visited[index_no], start)
+        results[index_no].sort()
+
+    return results
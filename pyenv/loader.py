@@ -0,0 +1,112 @@
+# -*- Mode: Python -*-
+
+import os
+import sys
+
+from . import cache
+from .timings import Timings
+
+# loads modulefiles by executing their code objects directly instead of going through the
+# import machinery.  compiled code objects are kept in memory and in the per-user cache
+# directory (never next to the modulefile, since module trees are often read-only), keyed
+# by the modulefile's path, mtime and size.
+class ModuleLoader(object):
+    def __init__(self):
+        # maps a modulefile path to ((mtime, size), code).
+        self.code_cache = dict()
+        self.cache_dir = None
+        self.cache_dir_checked = False
+
+
+    def get_cache_path(self, path):
+        if (not self.cache_dir_checked):
+            self.cache_dir = cache.cache_directory("code")
+            self.cache_dir_checked = True
+
+        if (self.cache_dir is None):
+            return None
+
+        # the marshal format is specific to the interpreter, so the cache files are too.
+        return os.path.join(self.cache_dir, "%s.%s" % (cache.cache_key(path),
+                                                       cache.interpreter_tag()))
+
+
+    def read_cached_code(self, cache_path, path, signature):
+        import marshal
+
+        Timings.get_timings().count("open")
+        try:
+            with open(cache_path, "rb") as fh:
+                cached_path, cached_signature, code = marshal.loads(fh.read())
+        except Exception:
+            return None
+
+        if (cached_path != path or
+            tuple(cached_signature) != signature):
+            return None
+
+        return code
+
+
+    def write_cached_code(self, cache_path, path, signature, code):
+        import marshal
+
+        cache.atomic_write(cache_path, marshal.dumps((path, signature, code)))
+
+
+    # return the compiled code object for a modulefile, compiling it only if neither the
+    # in-memory cache nor the on-disk cache has a code object for this version of the file.
+    def get_code(self, path):
+        Timings.get_timings().count("stat")
+        st = os.stat(path)
+        signature = (st.st_mtime, st.st_size)
+
+        cached = self.code_cache.get(path)
+        if (cached is not None and
+            cached[0] == signature):
+            return cached[1]
+
+        cache_path = self.get_cache_path(path)
+        code = None
+        if (cache_path is not None):
+            code = self.read_cached_code(cache_path, path, signature)
+
+        if (code is None):
+            Timings.get_timings().count("compile")
+            with open(path, "rb") as fh:
+                source = fh.read()
+            code = compile(source, path, "exec", 0, True)
+
+            if (cache_path is not None):
+                self.write_cached_code(cache_path, path, signature, code)
+
+        self.code_cache[path] = (signature, code)
+        return code
+
+
+    # execute a modulefile as the python module module_name and return it.  the
+    # modulefile's directory is on sys.path while it runs so that it can import its
+    # siblings, as it could when modulefiles were imported.
+    def load(self, module_name, path):
+        import types
+
+        code = self.get_code(path)
+
+        module = types.ModuleType(module_name)
+        module.__file__ = path
+        # modulefiles used to be imported as top-level modules; keep imports inside them
+        # absolute rather than relative to a nonexistent parent package.
+        module.__package__ = ""
+        sys.modules[module_name] = module
+
+        old_sys_path = sys.path[:]
+        try:
+            sys.path.insert(0, os.path.dirname(path))
+            exec(code, module.__dict__)
+        except:
+            del sys.modules[module_name]
+            raise
+        finally:
+            sys.path = old_sys_path
+
+        return module
@@ -0,0 +1,88 @@
+# -*- Mode: Python -*-
+
+# the declarative metadata a Module class may define (see pyenv.module.Module).
+METADATA_FIELDS = ("dependencies", "conflicts", "family", "description")
+
+# base classes that provide the default, metadata-driven preload.
+MODULE_BASES = ("Module", "pyenv.Module", "pyenv.module.Module")
+
+
+def dotted_name(node):
+    import ast
+
+    if (isinstance(node, ast.Name)):
+        return node.id
+    elif (isinstance(node, ast.Attribute)):
+        parent = dotted_name(node.value)
+        if (parent is not None):
+            return "%s.%s" % (parent, node.attr)
+
+    return None
+
+
+# find the class a modulefile exports as Module, following a simple "Module = X" alias.
+def find_module_class(tree):
+    import ast
+
+    classes = dict()
+    target = "Module"
+    for node in tree.body:
+        if (isinstance(node, ast.ClassDef)):
+            classes[node.name] = node
+        elif (isinstance(node, ast.Assign) and
+              len(node.targets) == 1 and
+              isinstance(node.targets[0], ast.Name) and
+              node.targets[0].id == "Module" and
+              isinstance(node.value, ast.Name)):
+            target = node.value.id
+            classes.pop("Module", None)
+
+    return classes.get(target)
+
+
+# extract the metadata of a modulefile by parsing it, without running any of its code.
+# returns None if the file cannot be parsed or does not define a Module class.  otherwise,
+# returns a dict with an entry for each of METADATA_FIELDS, plus "static", which is True if
+# the metadata alone determines what the module's preload does, i.e., the class inherits
+# the default preload and all of its metadata are literals.
+def extract_metadata(path):
+    import ast
+
+    try:
+        with open(path, "rb") as fh:
+            source = fh.read()
+        tree = ast.parse(source, path)
+    except (IOError, OSError, SyntaxError, ValueError, TypeError):
+        return None
+
+    module_class = find_module_class(tree)
+    if (module_class is None):
+        return None
+
+    metadata = {"dependencies": None,
+                "conflicts": (),
+                "family": None,
+                "description": None}
+    static = all([dotted_name(base) in MODULE_BASES
+                  for base in module_class.bases])
+
+    for node in module_class.body:
+        if (isinstance(node, ast.FunctionDef) and
+            node.name == "preload"):
+            static = False
+        elif (isinstance(node, ast.Assign)):
+            for target in node.targets:
+                if (not isinstance(target, ast.Name) or
+                    target.id not in METADATA_FIELDS):
+                    continue
+
+                try:
+                    metadata[target.id] = ast.literal_eval(node.value)
+                except (ValueError, TypeError, SyntaxError):
+                    static = False
+
+    if (metadata["dependencies"] is None):
+        static = False
+    metadata["static"] = static
+
+    return metadata
@@ -1,6 +1,28 @@
 # -*- Mode: Python -*- 
 
+from .errors import *
+
 class Module(object):
+    # declarative metadata.  as long as these are plain literals, they can be read by
+    # parsing the modulefile without running it (see pyenv.metadata).
+    #
+    # dependencies is a list of the modules this module depends on.  conflicts is a list
+    # of modules that cannot be loaded at the same time as this module.  at most one
+    # module of a family may be loaded at a time.
+    dependencies = None
+    conflicts = ()
+    family = None
+    description = None
+
+    # with the replay cache enabled (see pyenv.replay), loading a module with static
+    # metadata may replay the shell operations of an earlier load instead of running
+    # load().  loads that look at the loaded modules or the shell's state are never
+    # replayed, but modules whose load() depends on anything else besides the modulefile
+    # and the environment variables it reads (e.g., the filesystem) should set this to
+    # False.
+    replayable = True
+
+
     def __init__(self, name):
         self.__name = name
 
@@ -11,8 +33,16 @@ class Module(object):
 
     # this should check for conflicts.  raise ModulePreloadError if we cannot complete the
     # operation.  if successful, return a list of modules that this module depends on.
+    #
+    # by default, this checks the declared conflicts and family and returns the declared
+    # dependencies.  modules that declare their dependencies need not override this, and
+    # should not, so that dependency planning does not need to run their code.
     def preload(self, env):
-        raise ModuleNotImplementedError()
+        if (self.dependencies is None):
+            raise ModuleNotImplementedError()
+
+        env.check_conflicts(self.name(), self.conflicts, self.family)
+        return list(self.dependencies)
 
 
     # this should do the actual load.  hopefully this doesn't fail as the checking should
@@ -48,14 +48,25 @@ class munge_parser(object):
 
     def __exit__(self, type, value, traceback):
         sys.stdout = self.old_stdout
+        del self.parser.add_option
+        del self.parser.set_defaults
 
 
 
 class TopLevelOptions(object):
+    # parsers are cached by (actions, shells, dest_prefix) so a long-lived process only
+    # builds them once.
+    parser_cache = dict()
+
+
     @staticmethod
-    def parse(args, valid_actions, valid_shells, dest_prefix = "tlo_"):
+    def get_parser(valid_actions, valid_shells, dest_prefix):
         import optparse
 
+        cache_key = (tuple(valid_actions), tuple(valid_shells), dest_prefix)
+        if (cache_key in TopLevelOptions.parser_cache):
+            return TopLevelOptions.parser_cache[cache_key]
+
         parser = optparse.OptionParser(usage="")
 
         # define a function to add options
@@ -74,13 +85,35 @@ class TopLevelOptions(object):
                               help="dump messages verbatim instead of generating "
                               "commands to dump them (may be ignored by different shell "
                               "implementations)")
+            parser.add_option("--output", action="store", dest="output",
+                              metavar="MODE",
+                              help="how to hand the commands to the shell: tempfile "
+                              "(the default, or $PYENV_OUTPUT), shm, stdout or fd:<n>")
+            parser.add_option("--timings", action="store_true", dest="timings",
+                              help="report where the time went (per phase and per "
+                              "module) and the filesystem calls made to console "
+                              "(stderr)")
+            parser.add_option("--timings-file", action="store", dest="timings_file",
+                              metavar="FILE",
+                              help="write the timings report as JSON to FILE")
+            parser.add_option("--profile", action="store", dest="profile",
+                              metavar="FILE",
+                              help="write a trace of the preload, load and unload calls "
+                              "of every module to FILE, in the trace event format")
+            parser.add_option("--profile-dir", action="store", dest="profile_dir",
+                              metavar="DIR",
+                              help="run the preload, load and unload calls of every "
+                              "module under cProfile and dump the statistics to DIR")
+            parser.add_option("--dedup-paths", action="store_true", dest="dedup_paths",
+                              help="move paths and compiler flags that are already "
+                              "present instead of adding them again")
 
             # stop when the first non-option argument
             # is encountered.
             parser.disable_interspersed_args()
 
             # capture the options help
-            TopLevelOptions.options_help = parser.format_help()
+            options_help = parser.format_help()
             def custom_format_help(formatter=None):
                 prog = sys.argv[0]
                 result = ("usage: %s [<options>]"
@@ -90,11 +123,22 @@ class TopLevelOptions(object):
                           "  %s\n"
                           "\n"
                           "execute %s <action> --help for action-specific help\n" %
-                          (prog, TopLevelOptions.options_help,
+                          (prog, options_help,
                            "\n  ".join(valid_actions), prog))
                 return result
             parser.format_help = custom_format_help
 
+        TopLevelOptions.parser_cache[cache_key] = (parser, options_help)
+        return (parser, options_help)
+
+
+    @staticmethod
+    def parse(args, valid_actions, valid_shells, dest_prefix = "tlo_"):
+        parser, TopLevelOptions.options_help = TopLevelOptions.get_parser(valid_actions,
+                                                                          valid_shells,
+                                                                          dest_prefix)
+
+        with munge_parser(parser, dest_prefix, sys.stderr) as ctxt:
             (options, leftover) = parser.parse_args(args)
 
             for key in dir(options):
@@ -0,0 +1,106 @@
+# -*- Mode: Python -*-
+
+import os
+
+
+# the directory temp files are created in.  this honors the same environment variables as
+# tempfile.gettempdir().
+def temp_directory():
+    for env_name in ("TMPDIR", "TEMP", "TMP"):
+        value = os.getenv(env_name)
+        if (value and
+            os.path.isdir(value)):
+            return value
+
+    return "/tmp"
+
+
+# write all of data to a file descriptor.
+def write_fd(fd, data):
+    while (len(data) != 0):
+        data = data[os.write(fd, data):]
+
+
+# write data to a new, private temp file and return its name.  this is the equivalent of
+# tempfile.NamedTemporaryFile(delete = False), without the cost of importing tempfile and
+# everything it pulls in.  the file is created in temp_dir if specified, or in
+# temp_directory() otherwise.
+def write_temp_file(data, temp_dir = None):
+    import binascii
+    import errno
+
+    if (temp_dir is None):
+        temp_dir = temp_directory()
+    for attempt in range(100):
+        name = os.path.join(temp_dir,
+                            "tmp%s" % binascii.hexlify(os.urandom(6)).decode("ascii"))
+        try:
+            fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError as e:
+            if (e.errno == errno.EEXIST):
+                continue
+            raise
+
+        try:
+            write_fd(fd, data)
+        finally:
+            os.close(fd)
+
+        return name
+
+    raise IOError(errno.EEXIST, "No usable temporary file name found")
+
+
+# the ways the commands can be handed to the shell wrapper:
+#
+#   tempfile    write them to a temp file and print its name.  the wrapper sources the
+#               file and deletes it.
+#   shm         like tempfile, but in /dev/shm (memory-backed) where available.
+#   stdout      print the commands themselves, for the wrapper to eval.
+#   fd:<n>      write the commands to the inherited file descriptor n.
+OUTPUT_MODES = ("tempfile", "shm", "stdout", "fd:<n>")
+
+
+# the output mode to use: the one requested on the command line, else PYENV_OUTPUT, else
+# tempfile.
+def output_mode(requested = None):
+    if (requested):
+        return requested
+
+    return os.getenv("PYENV_OUTPUT") or "tempfile"
+
+
+# raise ValueError if mode is not a valid output mode.
+def check_output_mode(mode):
+    if (mode in ("tempfile", "shm", "stdout")):
+        return
+
+    if (mode.startswith("fd:") and
+        mode[3:].isdigit()):
+        return
+
+    raise ValueError("invalid output mode %s (valid modes: %s)" %
+                     (mode, ", ".join(OUTPUT_MODES)))
+
+
+# the directory memory-backed temp files are created in.
+def shm_directory():
+    if (os.path.isdir("/dev/shm") and
+        os.access("/dev/shm", os.W_OK | os.X_OK)):
+        return "/dev/shm"
+
+    return temp_directory()
+
+
+# hand data, the encoded commands, to the shell wrapper using the given output mode.
+def write_output(mode, data):
+    import sys
+
+    if (mode == "stdout"):
+        sys.stdout.flush()
+        write_fd(sys.stdout.fileno(), data)
+    elif (mode.startswith("fd:")):
+        write_fd(int(mode[3:]), data)
+    else:
+        name = write_temp_file(data, shm_directory() if mode == "shm" else None)
+        sys.stdout.write("%s\n" % name)
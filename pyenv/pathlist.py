@@ -0,0 +1,207 @@
+# -*- Mode: Python -*-
+
+from collections import deque
+
+class PathListNode(object):
+    __slots__ = ("prev", "next", "value")
+
+    def __init__(self, value):
+        self.prev = None
+        self.next = None
+        self.value = value
+
+
+# an ordered list of path components (or compiler flags) backed by a doubly linked list
+# and an index from each value to its nodes.  membership tests, prepending, appending and
+# removing the first occurrence of a value are all O(1).
+#
+# duplicates are kept, just like a list, unless dedup is set.  with dedup, prepending or
+# appending a value that is already present moves it to the front or the back instead.
+#
+# prepend, append and remove return an undo record, a list of the steps they took.  passing
+# it to undo reverts the change in O(1) per step, provided every change made after it has
+# been undone first.
+class PathList(object):
+    def __init__(self, items = (), dedup = False):
+        self.dedup = dedup
+
+        self.head = None
+        self.tail = None
+        self.length = 0
+
+        # maps each value to a deque of its nodes, in list order.  since values are only
+        # ever added at either end of the list, a new node always goes at one end of its
+        # deque too.
+        self.nodes = dict()
+
+        for item in items:
+            self.link_last(PathListNode(item))
+
+
+    def link_first(self, node):
+        node.next = self.head
+        if (self.head is not None):
+            self.head.prev = node
+        else:
+            self.tail = node
+        self.head = node
+
+        value_nodes = self.nodes.get(node.value)
+        if (value_nodes is None):
+            value_nodes = self.nodes[node.value] = deque()
+        value_nodes.appendleft(node)
+        self.length = self.length + 1
+
+
+    def link_last(self, node):
+        node.prev = self.tail
+        if (self.tail is not None):
+            self.tail.next = node
+        else:
+            self.head = node
+        self.tail = node
+
+        value_nodes = self.nodes.get(node.value)
+        if (value_nodes is None):
+            value_nodes = self.nodes[node.value] = deque()
+        value_nodes.append(node)
+        self.length = self.length + 1
+
+
+    # link a node back in between the nodes it was unlinked from.
+    def relink(self, node, prev, next):
+        node.prev = prev
+        node.next = next
+        if (prev is not None):
+            prev.next = node
+        else:
+            self.head = node
+        if (next is not None):
+            next.prev = node
+        else:
+            self.tail = node
+        self.length = self.length + 1
+
+
+    def unlink(self, node):
+        if (node.prev is not None):
+            node.prev.next = node.next
+        else:
+            self.head = node.next
+        if (node.next is not None):
+            node.next.prev = node.prev
+        else:
+            self.tail = node.prev
+
+        node.prev = None
+        node.next = None
+        self.length = self.length - 1
+
+
+    # remove every occurrence of value, and add the steps taken to the undo record.
+    def discard_all(self, value, undo_record):
+        value_nodes = self.nodes.pop(value, None)
+        if (value_nodes is None):
+            return
+
+        unlinked = []
+        for node in value_nodes:
+            unlinked.append((node, node.prev, node.next))
+            self.unlink(node)
+        undo_record.append(("discarded", value, value_nodes, unlinked))
+
+
+    def prepend(self, value):
+        undo_record = []
+        if (self.dedup):
+            self.discard_all(value, undo_record)
+        node = PathListNode(value)
+        self.link_first(node)
+        undo_record.append(("linked_first", node))
+        return undo_record
+
+
+    def append(self, value):
+        undo_record = []
+        if (self.dedup):
+            self.discard_all(value, undo_record)
+        node = PathListNode(value)
+        self.link_last(node)
+        undo_record.append(("linked_last", node))
+        return undo_record
+
+
+    # remove the first occurrence of value.  like list.remove, raises ValueError if value
+    # is not present.
+    def remove(self, value):
+        value_nodes = self.nodes.get(value)
+        if (not value_nodes):
+            raise ValueError("%r is not in the path list" % (value,))
+
+        node = value_nodes.popleft()
+        if (len(value_nodes) == 0):
+            del self.nodes[value]
+        undo_record = [("unlinked", node, node.prev, node.next)]
+        self.unlink(node)
+        return undo_record
+
+
+    # revert the change that returned undo_record.
+    def undo(self, undo_record):
+        for step in reversed(undo_record):
+            if (step[0] == "linked_first" or
+                step[0] == "linked_last"):
+                node = step[1]
+                self.unlink(node)
+                value_nodes = self.nodes[node.value]
+                if (step[0] == "linked_first"):
+                    value_nodes.popleft()
+                else:
+                    value_nodes.pop()
+                if (len(value_nodes) == 0):
+                    del self.nodes[node.value]
+            elif (step[0] == "unlinked"):
+                kind, node, prev, next = step
+                self.relink(node, prev, next)
+                value_nodes = self.nodes.get(node.value)
+                if (value_nodes is None):
+                    value_nodes = self.nodes[node.value] = deque()
+                value_nodes.appendleft(node)
+            else:
+                kind, value, value_nodes, unlinked = step
+                for node, prev, next in reversed(unlinked):
+                    self.relink(node, prev, next)
+                self.nodes[value] = value_nodes
+
+
+    def __contains__(self, value):
+        return value in self.nodes
+
+
+    def __iter__(self):
+        node = self.head
+        while (node is not None):
+            yield node.value
+            node = node.next
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __eq__(self, other):
+        if (isinstance(other, (PathList, list, tuple))):
+            return (len(self) == len(other) and
+                    all([mine == theirs for mine, theirs in zip(self, other)]))
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if (result is NotImplemented):
+            return result
+        return not result
+
+
+    def __repr__(self):
+        return "PathList(%r)" % (list(self),)
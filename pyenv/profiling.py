@@ -0,0 +1,139 @@
+# -*- Mode: Python -*-
+
+import os
+
+from .timings import clock
+
+# a block that does nothing, for when profiling is off.
+class NullBlock(object):
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+null_block = NullBlock()
+
+
+# records a complete trace event for the duration of a block, and optionally runs cProfile
+# over it.
+class ProfiledBlock(object):
+    def __init__(self, profiler, name, category, args, profile_path):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+        self.profile_path = profile_path
+        self.profile = None
+
+
+    def __enter__(self):
+        if (self.profile_path is not None):
+            import cProfile
+
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        self.start = clock()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        end = clock()
+
+        if (self.profile is not None):
+            self.profile.disable()
+            try:
+                self.profile.dump_stats(self.profile_path)
+            except (IOError, OSError):
+                pass
+
+        event = {"name": self.name,
+                 "cat": self.category,
+                 "ph": "X",
+                 "ts": (self.start - self.profiler.start) * 1000000.0,
+                 "dur": (end - self.start) * 1000000.0,
+                 "pid": self.profiler.pid,
+                 "tid": 1}
+        if (self.args is not None):
+            event["args"] = self.args
+        if (type is not None):
+            event.setdefault("args", dict())["error"] = str(value)
+        self.profiler.events.append(event)
+
+
+# opt-in profiling of the modulefile code run by Environment.  with a trace path, every
+# preload, load and unload of a module (and the batches of dependency loads around them)
+# is recorded as a span, and the spans are written out in the trace event format, which
+# trace viewers such as chrome://tracing or Perfetto display.  with a profile directory,
+# each of those module calls is also run under cProfile, and its statistics dumped to
+# <module>.<step>.prof in that directory.
+class Profiler(object):
+    instance = None
+
+
+    def __init__(self, trace_path = None, profile_dir = None):
+        self.trace_path = trace_path
+        self.profile_dir = profile_dir
+        self.enabled = (trace_path is not None or profile_dir is not None)
+
+        if (profile_dir is not None and
+            not os.path.isdir(profile_dir)):
+            try:
+                os.makedirs(profile_dir)
+            except OSError:
+                pass
+
+        self.start = clock()
+        self.pid = os.getpid()
+        self.events = []
+
+
+    @classmethod
+    def get_profiler(cls):
+        if (cls.instance is None):
+            cls.instance = cls()
+
+        return cls.instance
+
+
+    @classmethod
+    def configure(cls, trace_path = None, profile_dir = None):
+        cls.instance = cls(trace_path, profile_dir)
+        return cls.instance
+
+
+    # with profiler.span("name", "category"): ...
+    def span(self, name, category, args = None):
+        if (not self.enabled):
+            return null_block
+
+        return ProfiledBlock(self, name, category, args, None)
+
+
+    # with profiler.module_call("lib.foo", "load"): ...
+    def module_call(self, module_name, step):
+        if (not self.enabled):
+            return null_block
+
+        profile_path = None
+        if (self.profile_dir is not None):
+            profile_path = os.path.join(self.profile_dir, "%s.%s.prof" % (module_name, step))
+
+        return ProfiledBlock(self, "%s %s" % (step, module_name), step,
+                             {"module": module_name}, profile_path)
+
+
+    # write out the trace, if one was requested.
+    def write(self):
+        if (self.trace_path is None):
+            return
+
+        import json
+
+        with open(self.trace_path, "w") as fh:
+            json.dump({"traceEvents": self.events,
+                       "displayTimeUnit": "ms"}, fh)
+            fh.write("\n")
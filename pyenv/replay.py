@@ -0,0 +1,214 @@
+# -*- Mode: Python -*-
+
+import os
+
+from . import cache
+
+# the methods of an environ mapping that look up a single variable.  every other method
+# looks at (or changes) the environment as a whole.
+ENVIRON_KEY_METHODS = ("__getitem__", "get", "__contains__", "has_key")
+ENVIRON_WHOLE_METHODS = ("__iter__", "__len__", "keys", "items", "values", "iterkeys",
+                         "iteritems", "itervalues", "copy", "__eq__", "__ne__", "__repr__",
+                         "__setitem__", "__delitem__", "pop", "popitem", "setdefault",
+                         "update", "clear")
+
+
+# remembers which variables are looked up in an environ mapping (os.environ) while it is
+# active.  anything that depends on the whole environment (iterating over it, copying it)
+# or changes it makes the load unrecordable.
+#
+# rather than standing in for os.environ, which code holding on to the mapping itself
+# (e.g., a helper that did "from os import environ" when it was first imported) would
+# bypass, the mapping's class is swapped for a subclass that records every read, however
+# the mapping is reached.  if the class cannot be swapped, reads cannot be tracked, and
+# everything counts as read.
+class EnvironRecorder(object):
+    def __init__(self, environ):
+        self.environ = environ
+        self.read_keys = set()
+        self.read_all = False
+        self.environ_class = None
+
+
+    def __enter__(self):
+        recorder = self
+        environ_class = self.environ.__class__
+
+        def key_method(method):
+            def inner(environ, key, *args):
+                recorder.read_keys.add(key)
+                return method(environ, key, *args)
+            return inner
+
+        def whole_method(method):
+            def inner(environ, *args, **kwargs):
+                recorder.read_all = True
+                return method(environ, *args, **kwargs)
+            return inner
+
+        methods = dict()
+        for name in ENVIRON_KEY_METHODS:
+            if (hasattr(environ_class, name)):
+                methods[name] = key_method(getattr(environ_class, name))
+        for name in ENVIRON_WHOLE_METHODS:
+            if (hasattr(environ_class, name)):
+                methods[name] = whole_method(getattr(environ_class, name))
+
+        # type() of a python 2 classic class makes another classic class.
+        recording_class = type(environ_class)("Recording%s" % environ_class.__name__,
+                                              (environ_class,), methods)
+        try:
+            self.environ.__class__ = recording_class
+        except TypeError:
+            self.read_all = True
+            return self
+
+        self.environ_class = environ_class
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        if (self.environ_class is not None):
+            self.environ.__class__ = self.environ_class
+            self.environ_class = None
+
+
+# the shell operations that are recorded in an op log (see Shell.recorded).
+SHELL_OPERATIONS = ("prepend_path", "append_path", "remove_path", "reset_path",
+                    "prepend_compiler_flag", "append_compiler_flag",
+                    "remove_compiler_flag", "reset_compiler_flag",
+                    "add_alias", "remove_alias",
+                    "add_shell_variable", "remove_shell_variable",
+                    "add_env", "remove_env",
+                    "write", "write_bulk")
+
+
+# stands in for the environment or the shell passed to a module's load(), and remembers
+# whether the module looked at their state (e.g., the loaded modules or the current
+# paths), since what it does may then depend on more than its inputs.  only calling the
+# methods in allowed doesn't count.
+class StateRecorder(object):
+    def __init__(self, target, allowed = ()):
+        self.target = target
+        self.allowed = allowed
+        self.read_state = False
+
+
+    def __getattr__(self, name):
+        if (name not in self.allowed):
+            self.read_state = True
+        return getattr(self.target, name)
+
+
+# caches the shell operations a module performed when it was loaded, so that a later load
+# of the same module can replay them without importing or running the modulefile.  the
+# cached operations are keyed by the hash of the modulefile's contents and by the values of
+# the environment variables the module read while loading.  loads that looked at the
+# environment as a whole, or at the state of the pyenv environment or the shell, are not
+# recorded.
+#
+# this is only correct for modules whose loads are deterministic given those inputs (a
+# load that looks at the filesystem, for instance, is not), so the cache is only used if
+# PYENV_REPLAY_CACHE is set, and modules can opt out by setting replayable to False.
+class ReplayCache(object):
+    VERSION = 2
+
+
+    def __init__(self):
+        self.cache_dir = cache.cache_directory("replay")
+
+
+    @staticmethod
+    def enabled():
+        return os.getenv("PYENV_REPLAY_CACHE", "") not in ("", "0")
+
+
+    def get_cache_path(self, path):
+        return os.path.join(self.cache_dir, "%s.pickle" % cache.cache_key(path))
+
+
+    @staticmethod
+    def content_hash(path):
+        import hashlib
+
+        with open(path, "rb") as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+
+
+    # returns the variants recorded for the current contents of the modulefile, as a dict
+    # mapping a tuple of variable names to a dict mapping a tuple of their values to an op
+    # log.
+    def read_variants(self, path, content_hash):
+        stored = cache.load_pickle(self.get_cache_path(path))
+        if (isinstance(stored, tuple) and
+            len(stored) == 4 and
+            stored[0] == ReplayCache.VERSION and
+            stored[1] == path and
+            stored[2] == content_hash):
+            return stored[3]
+
+        return dict()
+
+
+    # return the op log recorded for the modulefile at path under the current environment,
+    # or None if there is none.
+    def lookup(self, path):
+        if (self.cache_dir is None):
+            return None
+
+        try:
+            content_hash = ReplayCache.content_hash(path)
+        except (IOError, OSError):
+            return None
+
+        for read_keys, op_logs in self.read_variants(path, content_hash).items():
+            values = tuple([os.environ.get(key) for key in read_keys])
+            op_log = op_logs.get(values)
+            if (op_log is not None):
+                return op_log
+
+        return None
+
+
+    # call load(env, shell), which should import the modulefile at path, load the resulting
+    # module with the env and shell it is given and return it, and record the operations it
+    # performs on the shell.  the op log is cached unless the module opted out, looked at
+    # the environment as a whole, or looked at the state of env or shell.
+    def record(self, path, env, shell, load):
+        env_recorder = StateRecorder(env)
+        shell_recorder = StateRecorder(shell, SHELL_OPERATIONS)
+        shell.op_log = []
+        try:
+            with EnvironRecorder(os.environ) as recorder:
+                module = load(env_recorder, shell_recorder)
+            op_log = shell.op_log
+        finally:
+            shell.op_log = None
+
+        if (self.cache_dir is None or
+            recorder.read_all or
+            env_recorder.read_state or
+            shell_recorder.read_state or
+            not getattr(module, "replayable", True)):
+            return
+
+        try:
+            content_hash = ReplayCache.content_hash(path)
+        except (IOError, OSError):
+            return
+
+        read_keys = tuple(sorted(recorder.read_keys))
+        values = tuple([os.environ.get(key) for key in read_keys])
+
+        import pickle
+
+        variants = self.read_variants(path, content_hash)
+        variants.setdefault(read_keys, dict())[values] = op_log
+        try:
+            cache.dump_pickle(self.get_cache_path(path),
+                              (ReplayCache.VERSION, path, content_hash, variants))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # the module passed something that cannot be pickled (e.g., a generator given
+            # to write_bulk) to an operation.  the load itself went fine; just don't cache
+            # it.
+            pass
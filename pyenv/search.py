@@ -0,0 +1,286 @@
+# -*- Mode: Python -*-
+
+import os
+
+from . import cache
+from .timings import Timings
+
+# an inverted index over the names and declared descriptions of the modules in a module
+# database, kept in the per-user cache directory next to the module indexes.  module names
+# and descriptions are split into lowercase tokens ("mpi.openmpi.4_1" becomes mpi, openmpi,
+# 4 and 1), and each token maps to the modules it occurs in.
+#
+# along with the index, we remember the signature of every directory of the database.  a
+# query only stats those directories; if none of them changed, the set of modules did not
+# change either, and the stored index is used.  otherwise, the database is scanned and the
+# index rebuilt.  the descriptions of the modulefiles that did not change come from the
+# module indexes, so only the ones that did are parsed again.
+#
+# a description edited in place changes no directory, so we also remember the signature of
+# every modulefile, and check those of the modules a query returns.  if any of them
+# changed, the index is rebuilt and the query run again.  a query thus costs a stat per
+# directory and per result, rather than per module.
+class SearchIndex(object):
+    VERSION = 3
+
+
+    def __init__(self, module_names, descriptions, name_postings, description_postings,
+                 roots, signatures):
+        # module names, sorted; modules are identified by their position in this list.
+        self.module_names = module_names
+        self.descriptions = descriptions
+
+        # map a token to a tuple of the modules whose names (or descriptions) contain it.
+        self.name_postings = name_postings
+        self.description_postings = description_postings
+
+        # the roots of the module database, and for each module, a (root number, mtime,
+        # size) tuple for its modulefile, or None if its mtime was too recent to trust.
+        self.roots = roots
+        self.signatures = signatures
+
+        # set if the index was built by this invocation, and so is known to be current.
+        self.current = False
+
+
+    @staticmethod
+    def tokenize(text):
+        import re
+
+        return set([token
+                    for token in re.split(r"[^a-z0-9]+", text.lower())
+                    if token])
+
+
+    # build an index from a sorted list of module names and lists of their descriptions
+    # (None for modules without one) and modulefile signatures.
+    @staticmethod
+    def build(module_names, descriptions, roots, signatures):
+        name_postings = dict()
+        description_postings = dict()
+
+        for module_id, module_name in enumerate(module_names):
+            for token in SearchIndex.tokenize(module_name):
+                name_postings.setdefault(token, []).append(module_id)
+            if (descriptions[module_id]):
+                for token in SearchIndex.tokenize(descriptions[module_id]):
+                    description_postings.setdefault(token, []).append(module_id)
+
+        return SearchIndex(module_names, descriptions,
+                           dict([(token, tuple(module_ids))
+                                 for token, module_ids in name_postings.items()]),
+                           dict([(token, tuple(module_ids))
+                                 for token, module_ids in description_postings.items()]),
+                           roots, signatures)
+
+
+    @staticmethod
+    def index_path(roots):
+        index_dir = cache.cache_directory("index")
+        if (index_dir is None):
+            return None
+
+        return os.path.join(index_dir, "search-%s.pickle" % cache.cache_key(*roots))
+
+
+    # returns True if none of the directories has changed since its signature was taken.
+    @staticmethod
+    def directories_unchanged(directories):
+        from .index import ModuleIndex
+
+        for dir_path, signature in directories:
+            if (signature is None):
+                return False
+
+            Timings.get_timings().count("stat")
+            try:
+                st = os.stat(dir_path)
+            except OSError:
+                return False
+
+            if (ModuleIndex.signature(st) != signature):
+                return False
+
+        return True
+
+
+    # the path of the modulefile of a module in the root root.
+    @staticmethod
+    def modulefile_path(root, module_name):
+        module_parts = module_name.split(".")
+        return os.path.join(root, *(module_parts[:-1] + ["%s.py" % module_parts[-1]]))
+
+
+    # returns True if none of the modulefiles of the given modules has changed since the
+    # index was built.
+    def modulefiles_unchanged(self, module_ids):
+        if (self.current):
+            return True
+
+        for module_id in module_ids:
+            signature = self.signatures[module_id]
+            if (signature is None):
+                return False
+
+            root_no, mtime, size = signature
+            Timings.get_timings().count("stat")
+            try:
+                st = os.stat(SearchIndex.modulefile_path(self.roots[root_no],
+                                                         self.module_names[module_id]))
+            except OSError:
+                return False
+
+            if ((st.st_mtime, st.st_size) != (mtime, size)):
+                return False
+
+        return True
+
+
+    # return the search index for a module database, building it if the set of modules
+    # may have changed since it was last built, or if rebuild is set.
+    @staticmethod
+    def for_database(mdb, rebuild = False):
+        roots = [os.path.abspath(path) for path in mdb.module_db_path]
+        index_path = SearchIndex.index_path(roots)
+
+        if (not rebuild and
+            index_path is not None):
+            stored = cache.load_pickle(index_path)
+            if (isinstance(stored, tuple) and
+                len(stored) == 8 and
+                stored[0] == SearchIndex.VERSION and
+                stored[1] == roots and
+                SearchIndex.directories_unchanged(stored[2])):
+                return SearchIndex(stored[4], stored[5], stored[6], stored[7],
+                                   roots, stored[3])
+
+        import time
+
+        from .index import ModuleIndex
+
+        with Timings.get_timings().phase("build search index"):
+            mdb.populate_db_cache()
+            module_names = sorted(mdb.database_cache.keys())
+
+            # each modulefile's signature is taken before its description is read, so an
+            # edit in between is caught by a later query.
+            now = time.time()
+            signatures = []
+            descriptions = []
+            for module_name in module_names:
+                signature = None
+                for root_no, root in enumerate(roots):
+                    module_path = SearchIndex.modulefile_path(root, module_name)
+                    if (module_path != mdb.database_cache[module_name]):
+                        continue
+
+                    Timings.get_timings().count("stat")
+                    try:
+                        st = os.stat(module_path)
+                    except OSError:
+                        break
+                    if (now - st.st_mtime >= ModuleIndex.MTIME_GRACE):
+                        signature = (root_no, st.st_mtime, st.st_size)
+                    break
+                signatures.append(signature)
+
+                metadata = mdb.get_metadata(module_name)
+                descriptions.append(None if metadata is None else metadata["description"])
+            mdb.save_indexes()
+
+            search_index = SearchIndex.build(module_names, descriptions, roots,
+                                             tuple(signatures))
+            search_index.current = True
+
+        if (index_path is not None):
+            # the scan has just brought every index up to date.
+            directories = []
+            for root in roots:
+                index = mdb.get_index(root)
+                directories.extend([(index.directory_path(relpath), entry[0])
+                                    for relpath, entry in index.directories.items()])
+
+            cache.dump_pickle(index_path,
+                              (SearchIndex.VERSION, roots, directories,
+                               search_index.signatures,
+                               search_index.module_names, search_index.descriptions,
+                               search_index.name_postings,
+                               search_index.description_postings))
+
+        return search_index
+
+
+    # search the index of a module database (see search).  if the modulefile of any module
+    # found has changed since the index was built, the index is rebuilt and the search
+    # run again.
+    @staticmethod
+    def search_database(mdb, terms, substring = False, fuzzy = False, rebuild = False):
+        search_index = SearchIndex.for_database(mdb, rebuild)
+        module_ids = search_index.find(terms, substring, fuzzy)
+        if (not search_index.modulefiles_unchanged(module_ids)):
+            search_index = SearchIndex.for_database(mdb, True)
+            module_ids = search_index.find(terms, substring, fuzzy)
+
+        return [(search_index.module_names[module_id], search_index.descriptions[module_id])
+                for module_id in module_ids]
+
+
+    # the modules in the postings of every token for which match(token) is true.
+    @staticmethod
+    def matching_modules(postings, match):
+        module_ids = set()
+        for token, token_module_ids in postings.items():
+            if (match(token)):
+                module_ids.update(token_module_ids)
+
+        return module_ids
+
+
+    # find the modules that match every term of a query.  the terms are split into tokens
+    # like the names and descriptions are.  by default, each token must be a whole token
+    # of the index.  with substring, it need only be part of a token, and with fuzzy, close
+    # to one.  returns a list of module ids, those that matched every term in their names
+    # first, each group sorted.
+    def find(self, terms, substring = False, fuzzy = False):
+        if (fuzzy):
+            import difflib
+
+            vocabulary = list(set(self.name_postings.keys()) |
+                              set(self.description_postings.keys()))
+
+        name_matches = None
+        all_matches = None
+        query_tokens = set()
+        for term in terms:
+            query_tokens.update(SearchIndex.tokenize(term))
+
+        for term in query_tokens:
+            if (fuzzy):
+                close = set(difflib.get_close_matches(term, vocabulary, 10, 0.75))
+                match = lambda token: token in close
+            elif (substring):
+                match = lambda token: term in token
+            else:
+                match = None
+
+            if (match is None):
+                term_name_matches = set(self.name_postings.get(term, ()))
+                term_matches = term_name_matches | set(self.description_postings.get(term, ()))
+            else:
+                term_name_matches = SearchIndex.matching_modules(self.name_postings, match)
+                term_matches = (term_name_matches |
+                                SearchIndex.matching_modules(self.description_postings,
+                                                             match))
+
+            if (all_matches is None):
+                name_matches = term_name_matches
+                all_matches = term_matches
+            else:
+                name_matches = name_matches & term_name_matches
+                all_matches = all_matches & term_matches
+
+        if (not all_matches):
+            return []
+
+        # module ids are in name order.
+        return sorted(name_matches) + sorted(all_matches - name_matches)
@@ -0,0 +1,230 @@
+# -*- Mode: Python -*-
+
+import os
+import sys
+
+from .errors import *
+from .statcache import StatCache
+from .timings import Timings
+
+# a long-lived modulecmd server.  clients connect over a unix domain socket, send their
+# argv, environment and working directory as a JSON object, and get back a JSON object
+# with the exit status, anything written to stderr, the list of shell commands that
+# modulecmd would have produced and the output mode to hand them over with.  requests are
+# handled one at a time since the option parsers and modulefiles rely on process-global
+# state (os.environ, sys.argv).  the module databases, along with their indexes and
+# compiled modulefiles, stay warm between requests.
+
+
+# returns the default socket path.  the modulecmd-client script carries a copy of this
+# logic so that it does not have to import pyenv; keep the two in sync.
+def default_socket_path():
+    path = os.getenv("PYENV_SERVER_SOCKET")
+    if (path):
+        return path
+
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if (not runtime_dir):
+        runtime_dir = os.path.join("/tmp", "pyenv-%d" % os.getuid())
+
+    return os.path.join(runtime_dir, "pyenv-modulecmd.sock")
+
+
+class ModuleServer(object):
+    def __init__(self, socket_path, idle_timeout = None):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+
+        # module databases, keyed by the environment they were built from.
+        self.databases = dict()
+
+        self.sock = None
+
+
+    # return a warm module database for the current environment.
+    def get_database(self):
+        from .db import ModuleDatabase
+
+        key = (os.getenv("PYENV_PATH"), os.getenv("PYENV_SCAN_THREADS"))
+        if (key not in self.databases):
+            self.databases[key] = ModuleDatabase()
+
+        mdb = self.databases[key]
+        mdb.reset_db_cache()
+        return mdb
+
+
+    # run a single request in the environment described by it.  returns the response.
+    def handle_request(self, request):
+        import traceback
+        try:
+            from StringIO import StringIO
+        except ImportError:
+            from io import StringIO
+
+        from . import options
+        from . import output
+        from .command import worker
+
+        saved_environ = dict(os.environ)
+        saved_argv = sys.argv
+        saved_stderr = sys.stderr
+        saved_cwd = os.getcwd()
+
+        stderr = StringIO()
+        status = 0
+        commands = None
+        output_mode = None
+        try:
+            os.environ.clear()
+            os.environ.update(request["environ"])
+            sys.argv = list(request["argv"])
+            sys.stderr = stderr
+            os.chdir(request["cwd"])
+
+            WarningLog.get_logger().clear()
+            StatCache.reset()
+            Timings.reset()
+            commands = worker(sys.argv[1:], self.get_database())
+            output_mode = output.output_mode(options.TopLevelOptions.output)
+        except OptionParsingError as e:
+            status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 2
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            sys.argv = saved_argv
+            sys.stderr = saved_stderr
+            os.chdir(saved_cwd)
+
+        return {"status": status,
+                "stderr": stderr.getvalue(),
+                "commands": commands,
+                "output": output_mode}
+
+
+    # only accept connections from our own user, where the platform lets us check.
+    def peer_allowed(self, conn):
+        import socket
+        import struct
+
+        if (not hasattr(socket, "SO_PEERCRED")):
+            return True
+
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                struct.calcsize("3i"))
+        pid, uid, gid = struct.unpack("3i", creds)
+        return uid == os.getuid()
+
+
+    def handle_connection(self, conn):
+        import json
+
+        if (not self.peer_allowed(conn)):
+            return
+
+        chunks = []
+        while (True):
+            data = conn.recv(65536)
+            if (not data):
+                break
+            chunks.append(data)
+
+        try:
+            request = json.loads(b"".join(chunks).decode("utf-8"))
+        except ValueError:
+            return
+
+        response = self.handle_request(request)
+        conn.sendall(json.dumps(response).encode("utf-8"))
+
+
+    def bind(self):
+        import socket
+
+        socket_dir = os.path.dirname(self.socket_path)
+        if (not os.path.isdir(socket_dir)):
+            os.makedirs(socket_dir, 0o700)
+        st = os.stat(socket_dir)
+        if (st.st_uid != os.getuid() or
+            (st.st_mode & 0o077) != 0):
+            raise ServerError("%s must be owned by you and not accessible by others" %
+                              socket_dir)
+
+        if (os.path.exists(self.socket_path)):
+            # is another server listening?
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except socket.error:
+                os.unlink(self.socket_path)
+            else:
+                raise ServerError("a server is already listening on %s" % self.socket_path)
+            finally:
+                probe.close()
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(64)
+
+
+    # serve requests until idle for idle_timeout seconds (or forever).
+    def serve_forever(self):
+        import socket
+
+        self.bind()
+        self.sock.settimeout(self.idle_timeout)
+        try:
+            while (True):
+                try:
+                    conn, address = self.sock.accept()
+                except socket.timeout:
+                    break
+
+                try:
+                    conn.settimeout(None)
+                    self.handle_connection(conn)
+                except socket.error:
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            self.sock.close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+
+def main(args):
+    import optparse
+    import signal
+
+    parser = optparse.OptionParser(usage="usage: %prog [<options>]")
+    parser.add_option("--socket", action="store", dest="socket",
+                      help="path of the unix domain socket to listen on")
+    parser.add_option("--idle-timeout", action="store", type="float", dest="idle_timeout",
+                      help="exit after this many seconds without a request")
+    parser.set_defaults(socket=default_socket_path())
+    (opts, leftover) = parser.parse_args(args)
+
+    # make sure the socket gets removed when we're asked to stop.
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, terminate)
+
+    server = ModuleServer(opts.socket, opts.idle_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
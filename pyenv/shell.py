@@ -4,6 +4,8 @@ import os
 import sys
 
 from .errors import *
+from .pathlist import PathList
+from .statcache import StatCache
 
 class ShellConstants(object):
     NOT_PATH = 0                # not a path.  ignore.
@@ -12,19 +14,43 @@ class ShellConstants(object):
                                 # does not.
 
 
+# a block of text written with Shell.write_bulk, held as the sequence of lines it was
+# given.  that may be an iterator (e.g., a generator producing a long listing), which is
+# only consumed when the message is emitted, so the lines can only be iterated over once.
+class BulkMessage(object):
+    def __init__(self, lines):
+        self.lines = lines
+
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+    def __str__(self):
+        return "\n".join(self.lines)
+
+
 # this should be subclassed by various shell implementations.
 class Shell(object):
+    # marks a key that did not exist when a savepoint recorded it.
+    ABSENT = object()
+
+
     def __init__(self, options):
+        # with dedup_paths, adding a path or flag that is already present moves it rather
+        # than adding it a second time.
+        self.dedup_paths = bool(getattr(options, "dedup_paths", False))
+
         # load up all the path settings.
 
-        self.paths = dict([(key, value.split(os.pathsep))
+        self.paths = dict([(key, PathList(value.split(os.pathsep), self.dedup_paths))
                            for key, value in os.environ.items()
                            if key.endswith("PATH")])
         self.original_paths = dict([(key, value.split(os.pathsep))
                                     for key, value in os.environ.items()
                                     if key.endswith("PATH")])
 
-        self.compiler_flags = dict([(key, value.split())
+        self.compiler_flags = dict([(key, PathList(value.split(), self.dedup_paths))
                                     for key, value in os.environ.items()
                                     if key.endswith("FLAGS")])
         self.original_compiler_flags = dict([(key, value.split())
@@ -42,27 +68,92 @@ class Shell(object):
 
         self.state_stack = []
 
+        # when this is a list, the operations performed on the shell are appended to it
+        # (see recorded and replay).
+        self.op_log = None
 
-    # preserve a copy of the current state (paths, env) onto a stack.
-    def push(self):
-        import copy
 
-        self.state_stack.append(copy.deepcopy( (self.paths,
-                                                self.compiler_flags,
-                                                self.aliases,
-                                                self.shell_variables,
-                                                self.environment_variables,
-                                                self.messages) ))
+    # take a savepoint of the current state (paths, env).  nothing is copied here; instead,
+    # every change made after the savepoint journals its inverse (the previous value of an
+    # alias or variable, or the undo record of a change to a path or flag group), so
+    # savepoints cost time proportional to the changes made under them rather than to the
+    # size of the environment or of the values changed.
+    def push(self):
+        self.state_stack.append(([], len(self.messages)))
 
 
-    # restores a copy of the current state (paths, env) from a stack.
+    # roll back every change made since the most recent savepoint, and discard it.
     def pop(self):
-        (self.paths,
-         self.compiler_flags,
-         self.aliases,
-         self.shell_variables,
-         self.environment_variables,
-         self.messages) = self.state_stack.pop()
+        journal, messages_length = self.state_stack.pop()
+        for entry in reversed(journal):
+            if (isinstance(entry[0], PathList)):
+                path_list, undo_record = entry
+                path_list.undo(undo_record)
+                continue
+
+            attribute, key, value = entry
+            container = getattr(self, attribute)
+            if (value is Shell.ABSENT):
+                if (key in container):
+                    del container[key]
+            else:
+                container[key] = value
+
+        del self.messages[messages_length:]
+
+
+    # keep every change made since the most recent savepoint, and discard it.  the changes
+    # can still be rolled back by popping an enclosing savepoint.
+    def commit(self):
+        journal, messages_length = self.state_stack.pop()
+        if (len(self.state_stack) != 0):
+            self.state_stack[-1][0].extend(journal)
+
+
+    # called before the value of key in the container attribute is replaced (or set, or
+    # deleted), to journal its current value.  values are replaced, never modified, so
+    # nothing needs to be copied.
+    def record(self, attribute, key):
+        if (len(self.state_stack) == 0):
+            return
+
+        container = getattr(self, attribute)
+        self.state_stack[-1][0].append((attribute, key, container.get(key, Shell.ABSENT)))
+
+
+    # called after a path or flag group was changed in place, to journal the change's undo
+    # record.
+    def record_change(self, path_list, undo_record):
+        if (len(self.state_stack) == 0):
+            return
+
+        self.state_stack[-1][0].append((path_list, undo_record))
+
+
+    # appends each successful call of the decorated operation to the op log, if there is
+    # one.  operations invoked by other operations are not logged separately.
+    def recorded(f):
+        def inner(self, *args, **kwargs):
+            op_log = self.op_log
+            if (op_log is None):
+                return f(self, *args, **kwargs)
+
+            self.op_log = None
+            try:
+                result = f(self, *args, **kwargs)
+            finally:
+                self.op_log = op_log
+            op_log.append((f.__name__, args, kwargs))
+            return result
+
+        inner.__name__ = f.__name__
+        return inner
+
+
+    # perform the operations in an op log again.
+    def replay(self, op_log):
+        for name, args, kwargs in op_log:
+            getattr(self, name)(*args, **kwargs)
 
 
     def path_decorate(f):
@@ -71,35 +162,42 @@ class Shell(object):
                 return self.remove_path(path, path_type, internal_call = True)
 
             if (check_path and
-                not os.access(path, os.X_OK)):
+                not StatCache.get_cache().access(path, os.X_OK)):
                 if (check_path == ShellConstants.ENFORCE_PATH):
                     raise ModuleLoadError("Path %s does not exist" % path)
                 return
 
             if (path_type not in self.paths):
-                self.paths[path_type] = []
+                self.record("paths", path_type)
+                self.paths[path_type] = PathList(dedup = self.dedup_paths)
 
             f(self, path, path_type)
 
+        inner.__name__ = f.__name__
         return inner
 
 
     # this should prepend a path component to one of the paths (e.g., PATH,
     # LD_LIBRARY_PATH).  at the end, dump_state will be called to set the final paths.
+    @recorded
     @path_decorate
     def prepend_path(self, path, path_type):
-        self.paths[path_type].insert(0, path)
+        path_list = self.paths[path_type]
+        self.record_change(path_list, path_list.prepend(path))
 
 
     # this should append a path component to one of the paths (e.g., PATH,
     # LD_LIBRARY_PATH).  at the end, dump_state will be called to set the final paths.
+    @recorded
     @path_decorate
     def append_path(self, path, path_type):
-        self.paths[path_type].append(path)
+        path_list = self.paths[path_type]
+        self.record_change(path_list, path_list.append(path))
 
 
     # this should remove a path component from one of the paths (e.g., PATH,
     # LD_LIBRARY_PATH).  at the end, dump_state will be called to set the final paths.
+    @recorded
     def remove_path(self, path, path_type = "PATH", internal_call = False):
         if (not internal_call and
             self.reverse_op):
@@ -108,19 +206,22 @@ class Shell(object):
         if (path_type not in self.paths):
             return
 
+        path_list = self.paths[path_type]
         try:
-            self.paths[path_type].remove(path)
+            self.record_change(path_list, path_list.remove(path))
         except ValueError:
             pass
 
 
     # this should reset one of the paths (e.g., PATH, LD_LIBRARY_PATH).  at the end,
     # dump_state will be called to set the final paths.
+    @recorded
     def reset_path(self, path_type = "PATH"):
         if (self.reverse_op):
             raise ShellReverseOperationError("Cannot reverse reset_path")
 
-        self.paths[path_type] = []
+        self.record("paths", path_type)
+        self.paths[path_type] = PathList(dedup = self.dedup_paths)
 
 
     def compiler_flags_decorate(f):
@@ -130,35 +231,42 @@ class Shell(object):
                                                  internal_call = True)
 
             if (path_checking != ShellConstants.NOT_PATH and
-                not os.access(flag, os.X_OK)):
+                not StatCache.get_cache().access(flag, os.X_OK)):
                 if (path_checking == ShellConstants.ENFORCE_PATH):
                     raise ModuleLoadError("Path %s does not exist" % flag)
                 return
 
             if (flag_type not in self.compiler_flags):
-                self.compiler_flags[flag_type] = []
+                self.record("compiler_flags", flag_type)
+                self.compiler_flags[flag_type] = PathList(dedup = self.dedup_paths)
 
             f(self, "%s%s" % (prefix, flag), flag_type)
 
+        inner.__name__ = f.__name__
         return inner
 
 
     # this should prepend a compiler flag to one of the flag groups (e.g., CPPFLAGS, LDFLAGS).
     # at the end, dump_state will be called to set the final flags.
+    @recorded
     @compiler_flags_decorate
     def prepend_compiler_flag(self, flag_value, flag_type):
-        self.compiler_flags[flag_type].insert(0, flag_value)
+        flag_list = self.compiler_flags[flag_type]
+        self.record_change(flag_list, flag_list.prepend(flag_value))
 
 
     # this should prepend a compiler flag to one of the flag groups (e.g., CPPFLAGS,
     # LDFLAGS).  at the end, dump_state will be called to set the final flags.
+    @recorded
     @compiler_flags_decorate
     def append_compiler_flag(self, flag_value, flag_type):
-        self.compiler_flags[flag_type].append(flag_value)
+        flag_list = self.compiler_flags[flag_type]
+        self.record_change(flag_list, flag_list.append(flag_value))
 
 
     # this should remove a compiler flag from one of the flag groups (e.g., CPPFLAGS,
     # LDFLAGS).  at the end, dump_state will be called to set the final paths.
+    @recorded
     def remove_compiler_flag(self, flag, flag_type, prefix = "",
                              internal_call = False):
         if (not internal_call and
@@ -168,73 +276,89 @@ class Shell(object):
         if (flag_type not in self.compiler_flags):
             return
 
+        flag_list = self.compiler_flags[flag_type]
         try:
-            self.compiler_flags[flag_type].remove("%s%s" % (prefix, flag))
+            self.record_change(flag_list, flag_list.remove("%s%s" % (prefix, flag)))
         except ValueError:
             pass
 
 
     # this should reset one of the compiler flag groups (e.g., CPPFLAGS, LDFLAGS).
+    @recorded
     def reset_compiler_flag(self, flag_type):
         if (self.reverse_op):
             raise ShellReverseOperationError("Cannot reverse reset_compiler_flag")
 
-        self.compiler_flags[flag_type] = []
+        self.record("compiler_flags", flag_type)
+        self.compiler_flags[flag_type] = PathList(dedup = self.dedup_paths)
 
 
     # this should add an alias
+    @recorded
     def add_alias(self, alias_name, cmd):
+        self.record("aliases", alias_name)
         self.aliases[alias_name] = cmd
 
 
     # this should remove up an alias
+    @recorded
     def remove_alias(self, alias_name, internal_call = False):
         if (not internal_call and
             self.reverse_op):
             raise ShellReverseOperationError("Cannot reverse remove_path")
 
+        self.record("aliases", alias_name)
         self.aliases[alias_name] = None
 
 
     # this should add a shell variable.  these would not be visible to programs spawned by
     # the shell.
+    @recorded
     def add_shell_variable(self, shell_env_name, value):
         if (self.reverse_op):
             return self.remove_shell_variable(shell_env_name, internal_call = True)
 
+        self.record("shell_variables", shell_env_name)
         self.shell_variables[shell_env_name] = value
 
 
     # this should remove up a shell variable.  these would not be visible to programs
     # spawned by the shell.
+    @recorded
     def remove_shell_variable(self, shell_env_name, internal_call = False):
         if (not internal_call and
             self.reverse_op):
             raise ShellReverseOperationError("Cannot reverse remove_shell_variable")
 
+        self.record("shell_variables", shell_env_name)
         self.shell_variables[shell_env_name] = None
 
 
     # this should add an environmental variable.  these would be visible to programs
     # spawned by the shell.
+    @recorded
     def add_env(self, env_name, value):
         if (self.reverse_op):
             return self.remove_env(env_name, internal_call = True)
 
+        self.record("environment_variables", env_name)
         self.environment_variables[env_name] = value
 
 
     # this should remove up an environmental variable.  these would be visible to programs
     # spawned by the shell.
+    @recorded
     def remove_env(self, env_name, internal_call = False):
         if (not internal_call and
             self.reverse_op):
             raise ShellReverseOperationError("Cannot reverse remove_shell_variable")
 
+        self.record("environment_variables", env_name)
         self.environment_variables[env_name] = None
 
 
     # this should write something to the console.
+    @recorded
     def write(self, message):
         if (self.reverse_op):
             raise ShellReverseOperationError("Cannot reverse remove_shell_variable")
@@ -242,6 +366,17 @@ class Shell(object):
         self.messages.append(message)
 
 
+    # this should write a large block of text, given as a sequence of lines, to the
+    # console.  the shell emits it as a single command rather than one command per line.
+    # lines can be an iterator; it is consumed when the state is dumped.
+    @recorded
+    def write_bulk(self, lines):
+        if (self.reverse_op):
+            raise ShellReverseOperationError("Cannot reverse write_bulk")
+
+        self.messages.append(BulkMessage(lines))
+
+
     # this should return an array of commands that should implement all the state changes.
     # this should not be called from any Module.
     def dump_state(self):
@@ -299,6 +434,13 @@ class TcshShell(Shell):
                 cmds.append("setenv %s '%s'" % (name, value))
 
         for message in self.messages:
+            if (isinstance(message, BulkMessage)):
+                # the terminator is chosen by looking at every line.
+                lines = list(message)
+                if (len(lines) != 0):
+                    cmds.append(TcshShell.here_document(lines))
+                continue
+
             # TODO: escaping the messages will be useful to do.
             msg_lines = message.split("\n")
             for msg_line in msg_lines:
@@ -307,6 +449,17 @@ class TcshShell(Shell):
         return cmds
 
 
+    # a command that prints lines verbatim: cat with a here document whose terminator is
+    # quoted, so that nothing in it is substituted.
+    @staticmethod
+    def here_document(lines):
+        terminator = "PYENV_EOF"
+        while (any([line == terminator for line in lines])):
+            terminator = terminator + "_"
+
+        return "cat << '%s'\n%s\n%s" % (terminator, "\n".join(lines), terminator)
+
+
 class BashShell(Shell):
     def dump_state(self):
         import os
@@ -353,6 +506,14 @@ class BashShell(Shell):
                 cmds.append("export %s='%s'" % (name, value))
 
         for message in self.messages:
+            if (isinstance(message, BulkMessage)):
+                # a single printf, which is a builtin, for the whole block.
+                words = " ".join(["'%s'" % line.replace("'", "'\\''")
+                                  for line in message])
+                if (len(words) != 0):
+                    cmds.append("printf '%%s\\n' %s" % words)
+                continue
+
             # TODO: escaping the messages will be useful to do.
             msg_lines = message.split("\n")
             for msg_line in msg_lines:
@@ -402,13 +563,55 @@ class Elisp(Shell):
 
         if (len(self.messages) != 0):
             if (self.options.raw_msg_dump):
-                cmds.append("\n".join(self.messages))
+                cmds.append("\n".join([str(message) for message in self.messages]))
+            elif (any([isinstance(message, BulkMessage) for message in self.messages])):
+                # bulk text can contain anything, so escape it and keep it out of the
+                # format string.
+                text = "\n".join([str(message) for message in self.messages])
+                cmds.append("(message \"%%s\" \"%s\")" %
+                            text.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
             else:
                 cmds.append("(message \"%s\")" % "\\n".join(self.messages))
 
         return cmds
 
 
+# a shell that emits nothing.  instead, the changes made to it are collected as a delta of
+# the environment (see pyenv.api).
+class DeltaShell(Shell):
+    def dump_state(self):
+        return []
+
+
+    # returns a dict mapping each environment variable that changed to its new value, or to
+    # None if it is unset.  aliases and shell variables are not part of the environment, so
+    # they are left out.
+    def environment_delta(self):
+        delta = dict()
+
+        for path_type, path_value in self.paths.items():
+            if (path_type in self.original_paths and
+                path_value == self.original_paths[path_type]):
+                continue
+            if (len(path_value) != 0):
+                delta[path_type] = os.pathsep.join(path_value)
+            else:
+                delta[path_type] = None
+
+        for compiler_flag_type, compiler_flag_value in self.compiler_flags.items():
+            if (compiler_flag_type in self.original_compiler_flags and
+                compiler_flag_value == self.original_compiler_flags[compiler_flag_type]):
+                continue
+            if (len(compiler_flag_value) != 0):
+                delta[compiler_flag_type] = " ".join(compiler_flag_value)
+            else:
+                delta[compiler_flag_type] = None
+
+        delta.update(self.environment_variables)
+
+        return delta
+
+
 shell_mapper = {
     "bash": BashShell,
     "tcsh": TcshShell,
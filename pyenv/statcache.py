@@ -0,0 +1,112 @@
+# -*- Mode: Python -*-
+
+import os
+
+# caches os.access results for the duration of an invocation.  modules tend to check the
+# same install prefixes over and over, and on automounted network filesystems every check
+# can be slow.
+#
+# optionally, misses can also be remembered across invocations for a short time: setting
+# PYENV_NEGATIVE_CACHE_TTL to a number of seconds makes paths found missing be reported
+# missing without touching the filesystem until the entry expires.
+class StatCache(object):
+    VERSION = 1
+
+    instance = None
+
+
+    def __init__(self):
+        # maps (path, mode) to the result of os.access.
+        self.results = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+        try:
+            self.negative_ttl = float(os.getenv("PYENV_NEGATIVE_CACHE_TTL", "0"))
+        except ValueError:
+            self.negative_ttl = 0
+
+        # maps (path, mode) to the time the negative entry expires.  loaded on first use.
+        self.negative_cache = None
+        self.negative_cache_path = None
+        self.negative_dirty = False
+
+
+    # the cache for this invocation.
+    @classmethod
+    def get_cache(cls):
+        if (cls.instance is None):
+            cls.instance = cls()
+
+        return cls.instance
+
+
+    # start over with an empty cache, e.g., for a new request in a long-lived process.
+    @classmethod
+    def reset(cls):
+        cls.instance = None
+
+
+    def load_negative_cache(self):
+        import time
+        from . import cache
+
+        self.negative_cache = dict()
+        cache_dir = cache.cache_directory()
+        if (cache_dir is None):
+            return
+
+        self.negative_cache_path = os.path.join(cache_dir, "negative.pickle")
+        stored = cache.load_pickle(self.negative_cache_path)
+        if (isinstance(stored, tuple) and
+            len(stored) == 2 and
+            stored[0] == StatCache.VERSION):
+            now = time.time()
+            self.negative_cache = dict([(key, expiry)
+                                        for key, expiry in stored[1].items()
+                                        if expiry > now])
+
+
+    # os.access(path, mode), cached.
+    def access(self, path, mode):
+        key = (path, mode)
+        result = self.results.get(key)
+        if (result is not None):
+            self.hits = self.hits + 1
+            return result
+
+        self.misses = self.misses + 1
+
+        if (self.negative_ttl > 0):
+            import time
+
+            if (self.negative_cache is None):
+                self.load_negative_cache()
+
+            now = time.time()
+            if (self.negative_cache.get(key, 0) > now):
+                self.negative_hits = self.negative_hits + 1
+                result = False
+            else:
+                result = os.access(path, mode)
+                if (not result):
+                    self.negative_cache[key] = now + self.negative_ttl
+                    self.negative_dirty = True
+        else:
+            result = os.access(path, mode)
+
+        self.results[key] = result
+        return result
+
+
+    # write out the persistent negative cache if it has changed.
+    def flush(self):
+        from . import cache
+
+        if (self.negative_dirty and
+            self.negative_cache_path is not None):
+            cache.dump_pickle(self.negative_cache_path,
+                              (StatCache.VERSION, self.negative_cache))
+        self.negative_dirty = False
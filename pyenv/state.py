@@ -0,0 +1,269 @@
+# -*- Mode: Python -*-
+
+# encoding and decoding of the environment's state (the loaded modules and the dependency
+# graph) for storage in PYENV_DATA_<n> environment variables.
+#
+# the current encoding is "2:" followed by the base64 of the zlib-compressed text
+#
+#   <count>\n<module>\t<module>\t...\n<dependency>:<dependent>,<dependent>;...
+#
+# where the first <count> modules are the loaded ones, any further modules only appear in
+# the dependency graph, and the dependency edges refer to modules by their position.  the
+# original encoding (a base64-encoded protocol 2 pickle, which never contains a ":") is
+# still decoded, so that existing shells migrate transparently.
+
+import os
+
+STATE_VERSION = 2
+STATE_PREFIX = "%d:" % STATE_VERSION
+
+# prefix of the environment variables the encoded state is split across.
+DATA_PREFIX = "PYENV_DATA_"
+
+# tcsh has historically been unhappy with very long words, so the encoded state is split
+# into chunks of this size unless PYENV_DATA_CHUNK_SIZE says otherwise.  0 means never
+# split.
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def chunk_size():
+    try:
+        return int(os.getenv("PYENV_DATA_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+    except ValueError:
+        return DEFAULT_CHUNK_SIZE
+
+
+def encode_state(loaded_modules, dependencies):
+    import binascii
+    import zlib
+
+    graph_modules = set(dependencies.keys())
+    for dependents in dependencies.values():
+        graph_modules.update(dependents)
+
+    modules = sorted(loaded_modules)
+    modules.extend(sorted(graph_modules - set(loaded_modules)))
+    positions = dict([(module_name, ix)
+                      for ix, module_name in enumerate(modules)])
+
+    edges = []
+    for dependency in modules:
+        dependents = dependencies.get(dependency)
+        if (not dependents):
+            continue
+        edges.append("%d:%s" % (positions[dependency],
+                                ",".join(["%d" % positions[dependent]
+                                          for dependent in sorted(dependents)])))
+
+    text = "%d\n%s\n%s" % (len(loaded_modules), "\t".join(modules), ";".join(edges))
+    compressed = zlib.compress(text.encode("utf-8"), 9)
+
+    return STATE_PREFIX + binascii.b2a_base64(compressed).decode("ascii").strip()
+
+
+def decode_state(encoded):
+    import binascii
+
+    if (not encoded.startswith(STATE_PREFIX)):
+        # the original pickle encoding.
+        import pickle
+
+        loaded_modules, dependencies = pickle.loads(binascii.a2b_base64(encoded))
+        return (set(loaded_modules), dict(dependencies))
+
+    import zlib
+
+    text = zlib.decompress(binascii.a2b_base64(encoded[len(STATE_PREFIX):]))
+    if (not isinstance(text, str)):
+        # python 3.  on python 2, keep the module names as native strings.
+        text = text.decode("utf-8")
+    count_line, module_line, edge_line = text.split("\n", 2)
+    modules = module_line.split("\t") if module_line else []
+
+    dependencies = dict()
+    for edge in edge_line.split(";"):
+        if (edge == ""):
+            continue
+        dependency, dependents = edge.split(":", 1)
+        dependencies[modules[int(dependency)]] = set([modules[int(dependent)]
+                                                     for dependent in dependents.split(",")])
+
+    return (set(modules[:int(count_line)]), dependencies)
+
+
+# gather the encoded state from an environment mapping.  returns a tuple of the encoded
+# string (None if there is no state) and the number of chunks it was split across.
+def read_chunks(environ):
+    chunks = dict()
+    for name, value in environ.items():
+        if (name.startswith(DATA_PREFIX) and
+            name[len(DATA_PREFIX):].isdigit()):
+            chunks[int(name[len(DATA_PREFIX):])] = value
+
+    count = 0
+    while (count in chunks):
+        count = count + 1
+
+    if (count == 0):
+        return (None, 0)
+
+    return ("".join([chunks[ix] for ix in range(count)]), count)
+
+
+# split an encoded state into (name, value) pairs of environment variables.
+def split_chunks(encoded, max_chunk_size = None):
+    if (max_chunk_size is None):
+        max_chunk_size = chunk_size()
+    if (max_chunk_size <= 0):
+        max_chunk_size = len(encoded)
+
+    return [("%s%d" % (DATA_PREFIX, chunk_no), encoded[ix:ix + max_chunk_size])
+            for chunk_no, ix in enumerate(range(0, len(encoded), max_chunk_size))]
+
+
+# session mode.  instead of carrying the encoded state in PYENV_DATA_<n>, the state is
+# written to a file in the per-user cache directory and only PYENV_SESSION, the file's
+# token, is exported.  state files are named by the hash of their contents and never
+# modified once written, so a child shell that changes its modules gets a new token while
+# its parent keeps pointing at the old state.  session mode is selected by setting
+# PYENV_STATE_MODE=session, and stays on for as long as PYENV_SESSION is set.
+SESSION_VARIABLE = "PYENV_SESSION"
+
+# state files that have not been used for PYENV_SESSION_MAX_AGE seconds are removed.  a
+# shell can sit idle for any length of time (e.g., in a long-lived tmux or screen session)
+# and still need its state, so by default (0), they are kept forever.
+DEFAULT_SESSION_MAX_AGE = 0
+
+# how often to look for expired state files.
+SESSION_PRUNE_INTERVAL = 24 * 60 * 60
+
+
+def session_max_age():
+    try:
+        return float(os.getenv("PYENV_SESSION_MAX_AGE", DEFAULT_SESSION_MAX_AGE))
+    except ValueError:
+        return DEFAULT_SESSION_MAX_AGE
+
+
+def use_sessions(environ):
+    return (environ.get("PYENV_STATE_MODE") == "session" or
+            SESSION_VARIABLE in environ)
+
+
+def session_path(token):
+    from . import cache
+
+    # tokens are hex digests; anything else is not ours.
+    if (len(token) == 0 or
+        token.strip("0123456789abcdef") != ""):
+        return None
+
+    session_dir = cache.cache_directory("sessions")
+    if (session_dir is None):
+        return None
+
+    return os.path.join(session_dir, token)
+
+
+# return the encoded state a session token refers to, or None if it cannot be read.
+def read_session(token):
+    path = session_path(token)
+    if (path is None):
+        return None
+
+    try:
+        with open(path, "rb") as fh:
+            encoded = fh.read().decode("ascii")
+    except (IOError, OSError):
+        return None
+
+    # mark the file as in use so it isn't pruned.
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+    return encoded
+
+
+# read the state a shell carries, in PYENV_DATA_<n> or in the session file PYENV_SESSION
+# names, from environ.  returns the loaded modules, the dependents of each module (see
+# decode_state) and the number of PYENV_DATA_<n> variables.  a state that cannot be
+# decoded is discarded with a warning.  raises SessionStateError if the session file
+# cannot be read.
+def read_state(environ):
+    import sys
+    from .errors import SessionStateError
+
+    encoded, chunk_count = read_chunks(environ)
+
+    # if the session file is gone (e.g., removed by PYENV_SESSION_MAX_AGE), carrying on
+    # with no modules loaded would silently replace the shell's state, so refuse.
+    session_token = environ.get(SESSION_VARIABLE)
+    if (session_token is not None):
+        encoded = read_session(session_token)
+        if (encoded is None):
+            raise SessionStateError(
+                "Unable to read session state %s; the modules loaded in this shell are "
+                "unknown.  Unset %s to start over with no modules loaded." %
+                (session_token, SESSION_VARIABLE))
+
+    if (encoded is not None):
+        try:
+            loaded_modules, dependents = decode_state(encoded)
+            return (loaded_modules, dependents, chunk_count)
+        except Exception as ex:
+            sys.stderr.write("Unable to decode prior environment ({}); discarding.\n".format(ex))
+
+    return (set(), dict(), chunk_count)
+
+
+# write an encoded state to a session file and return its token, or None if there is
+# nowhere to write it.
+def write_session(encoded):
+    import hashlib
+    from . import cache
+
+    token = hashlib.sha1(encoded.encode("ascii")).hexdigest()
+    path = session_path(token)
+    if (path is None):
+        return None
+
+    if (os.path.exists(path)):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+    elif (not cache.atomic_write(path, encoded.encode("ascii"))):
+        return None
+
+    prune_sessions(os.path.dirname(path))
+    return token
+
+
+# remove state files nobody has used in session_max_age() seconds, if that is set.  this
+# only scans the directory once every SESSION_PRUNE_INTERVAL.
+def prune_sessions(session_dir):
+    import time
+
+    max_age = session_max_age()
+    if (max_age <= 0):
+        return
+
+    now = time.time()
+    stamp_path = os.path.join(session_dir, ".pruned")
+    try:
+        if (now - os.stat(stamp_path).st_mtime < SESSION_PRUNE_INTERVAL):
+            return
+    except OSError:
+        pass
+
+    try:
+        open(stamp_path, "w").close()
+        for name in os.listdir(session_dir):
+            path = os.path.join(session_dir, name)
+            if (not name.startswith(".") and
+                now - os.stat(path).st_mtime > max_age):
+                os.unlink(path)
+    except (IOError, OSError):
+        pass
@@ -0,0 +1,51 @@
+# -*- Mode: Python -*-
+
+import sys
+
+# a minimal thread pool: call function on every item using up to the given number of
+# threads, and return the results in the same order as items.  if any call raises, the
+# remaining items are abandoned and the first exception is re-raised.
+#
+# multiprocessing.pool.ThreadPool would do, but importing it costs more than a typical
+# modulecmd invocation spends on everything else.
+def parallel_map(function, items, threads):
+    items = list(items)
+    if (threads <= 1 or
+        len(items) <= 1):
+        return [function(item) for item in items]
+
+    import threading
+
+    results = [None] * len(items)
+    errors = []
+    lock = threading.Lock()
+    position = [0]
+
+    def work():
+        while (True):
+            with lock:
+                ix = position[0]
+                if (ix >= len(items) or
+                    len(errors) != 0):
+                    return
+                position[0] = ix + 1
+
+            try:
+                results[ix] = function(items[ix])
+            except BaseException:
+                with lock:
+                    errors.append(sys.exc_info()[1])
+                return
+
+    workers = [threading.Thread(target = work)
+               for worker_no in range(min(threads, len(items)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if (len(errors) != 0):
+        raise errors[0]
+
+    return results
@@ -0,0 +1,163 @@
+# -*- Mode: Python -*-
+
+import sys
+import time
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+# times a block of code, and hands the elapsed time to a callback on the way out.
+class TimedBlock(object):
+    def __init__(self, callback):
+        self.callback = callback
+
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.callback(clock() - self.start)
+
+
+# where the time of an invocation goes: the phases of the worker (nested phases are
+# recorded with their depth), the steps of each module (import, preload, load, ...), and
+# counts of filesystem calls.  timings are always collected, since that is cheap; the
+# --timings option only controls whether they are reported.
+#
+# the filesystem counts are approximate when the database is scanned by several threads.
+class Timings(object):
+    instance = None
+
+
+    def __init__(self):
+        self.start = clock()
+        self.depth = 0
+
+        # a list of (depth, name, seconds), in the order the phases started.
+        self.phases = []
+
+        # maps a module name to a dict mapping each step to the time it took, and the
+        # order the modules were first seen in.
+        self.modules = dict()
+        self.module_order = []
+
+        # maps the name of a filesystem call to the number of times it was made.
+        self.counters = dict()
+
+
+    @classmethod
+    def get_timings(cls):
+        if (cls.instance is None):
+            cls.instance = cls()
+
+        return cls.instance
+
+
+    # start over, e.g., for a new request in a long-lived process.
+    @classmethod
+    def reset(cls):
+        cls.instance = None
+
+
+    # with Timings.get_timings().phase("name"): ...
+    def phase(self, name):
+        entry = [self.depth, name, 0.0]
+        self.phases.append(entry)
+        self.depth = self.depth + 1
+
+        def finish(seconds):
+            self.depth = self.depth - 1
+            entry[2] = seconds
+
+        return TimedBlock(finish)
+
+
+    # with Timings.get_timings().module_step("lib.foo", "load"): ...
+    def module_step(self, module_name, step):
+        def finish(seconds):
+            if (module_name not in self.modules):
+                self.modules[module_name] = dict()
+                self.module_order.append(module_name)
+            steps = self.modules[module_name]
+            steps[step] = steps.get(step, 0.0) + seconds
+
+        return TimedBlock(finish)
+
+
+    def count(self, name, calls = 1):
+        self.counters[name] = self.counters.get(name, 0) + calls
+
+
+    def elapsed(self):
+        return clock() - self.start
+
+
+    # the counters, including the os.access calls the stat cache answered or made.
+    def all_counters(self):
+        from .statcache import StatCache
+
+        counters = dict(self.counters)
+        stat_cache = StatCache.get_cache()
+        counters["access"] = stat_cache.misses - stat_cache.negative_hits
+        counters["access (cached)"] = stat_cache.hits + stat_cache.negative_hits
+        return counters
+
+
+    def as_dict(self):
+        return {
+            "total": self.elapsed(),
+            "phases": [{"name": name, "depth": depth, "seconds": seconds}
+                       for depth, name, seconds in self.phases],
+            "modules": dict([(module_name, dict(steps))
+                             for module_name, steps in self.modules.items()]),
+            "counters": self.all_counters(),
+        }
+
+
+    # return a human-readable report, as a list of lines.
+    def format_report(self):
+        lines = ["timings (ms):"]
+        for depth, name, seconds in self.phases:
+            lines.append("  %-40s %9.3f" % ("  " * depth + name, seconds * 1000.0))
+        lines.append("  %-40s %9.3f" % ("total", self.elapsed() * 1000.0))
+
+        if (len(self.module_order) != 0):
+            steps = []
+            for module_name in self.module_order:
+                steps.extend([step
+                              for step in sorted(self.modules[module_name].keys())
+                              if step not in steps])
+
+            lines.append("modules (ms):")
+            lines.append("  %-30s%s" % ("", "".join(["%10s" % step for step in steps])))
+            for module_name in self.module_order:
+                module_steps = self.modules[module_name]
+                lines.append("  %-30s%s" %
+                             (module_name,
+                              "".join([("%10.3f" % (module_steps[step] * 1000.0))
+                                       if step in module_steps else ("%10s" % "-")
+                                       for step in steps])))
+
+        counters = self.all_counters()
+        lines.append("filesystem calls: %s" %
+                     ", ".join(["%s %d" % (name, counters[name])
+                                for name in sorted(counters.keys())]))
+
+        return lines
+
+
+    def write_report(self):
+        sys.stderr.write("\n".join(self.format_report()) + "\n")
+
+
+    def write_json(self, path):
+        import json
+
+        with open(path, "w") as fh:
+            json.dump(self.as_dict(), fh, indent = 2, sort_keys = True)
+            fh.write("\n")
@@ -0,0 +1,145 @@
+# -*- Mode: Python -*-
+
+import os
+
+from . import cache
+
+# returns True if any of the statements binds the name Module at module level, be it by a
+# class definition, an assignment or an import (from x import Module, import x as Module).
+# a star import might bind it, so it counts too.  statements nested in if, try, with and
+# loop blocks run at module level as well, so they are looked at; function and class
+# bodies are not.
+def binds_module(statements):
+    import ast
+
+    for node in statements:
+        if (isinstance(node, ast.ClassDef) and
+            node.name == "Module"):
+            return True
+        elif (isinstance(node, ast.Assign) and
+              any([isinstance(target, ast.Name) and target.id == "Module"
+                   for target in node.targets])):
+            return True
+        elif (isinstance(node, (ast.Import, ast.ImportFrom)) and
+              any([alias.name == "*" or
+                   (alias.asname or alias.name.split(".")[0]) == "Module"
+                   for alias in node.names])):
+            return True
+        elif (isinstance(node, (ast.FunctionDef, ast.ClassDef,
+                                getattr(ast, "AsyncFunctionDef", ast.FunctionDef)))):
+            continue
+
+        for field in ("body", "orelse", "finalbody"):
+            if (binds_module(getattr(node, field, ()))):
+                return True
+        for handler in getattr(node, "handlers", ()):
+            if (binds_module(handler.body)):
+                return True
+
+    return False
+
+
+# check that a modulefile parses and defines a top-level Module.  the file is only parsed,
+# never executed.  this runs in worker processes, so it must remain a module-level
+# function.
+def check_module_file(path):
+    import ast
+
+    try:
+        with open(path, "rb") as fh:
+            tree = ast.parse(fh.read(), path)
+    except Exception:
+        return False
+
+    return binds_module(tree.body)
+
+
+# validates modulefiles in parallel and remembers the results.  results are cached per
+# interpreter in the per-user cache directory, keyed by each file's mtime and size, so
+# unchanged files are never checked again.
+class SyntaxValidator(object):
+    VERSION = 2
+
+    # below this many files, a process pool costs more than it saves.
+    MIN_POOL_SIZE = 16
+
+
+    # processes is the size of the process pool; None uses one per cpu.
+    def __init__(self, processes = None):
+        self.processes = processes
+
+        # maps a modulefile path to ((mtime, size), result).
+        self.results = dict()
+        self.dirty = False
+
+        self.cache_path = None
+        cache_dir = cache.cache_directory("syntax")
+        if (cache_dir is not None):
+            self.cache_path = os.path.join(cache_dir,
+                                           "results.%s.pickle" % cache.interpreter_tag())
+            stored = cache.load_pickle(self.cache_path)
+            if (isinstance(stored, tuple) and
+                len(stored) == 2 and
+                stored[0] == SyntaxValidator.VERSION):
+                self.results = stored[1]
+
+
+    def check_files(self, paths):
+        if (len(paths) < SyntaxValidator.MIN_POOL_SIZE or
+            self.processes == 1):
+            return [check_module_file(path) for path in paths]
+
+        import multiprocessing
+
+        processes = self.processes
+        if (processes is None):
+            processes = multiprocessing.cpu_count()
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunksize = max(1, len(paths) // (processes * 4))
+            return pool.map(check_module_file, paths, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+
+    # validate a list of modulefiles.  returns a dict mapping each path to True if it is a
+    # valid modulefile.
+    def validate(self, paths):
+        results = dict()
+        pending = []
+        pending_signatures = []
+
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                results[path] = False
+                continue
+
+            signature = (st.st_mtime, st.st_size)
+            cached = self.results.get(path)
+            if (cached is not None and
+                cached[0] == signature):
+                results[path] = cached[1]
+            else:
+                pending.append(path)
+                pending_signatures.append(signature)
+
+        if (len(pending) != 0):
+            for path, signature, result in zip(pending, pending_signatures,
+                                               self.check_files(pending)):
+                results[path] = result
+                self.results[path] = (signature, result)
+            self.dirty = True
+
+        self.save()
+        return results
+
+
+    def save(self):
+        if (self.dirty and
+            self.cache_path is not None):
+            cache.dump_pickle(self.cache_path, (SyntaxValidator.VERSION, self.results))
+        self.dirty = False
@@ -0,0 +1,107 @@
+# -*- Mode: Python -*-
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULECMD = os.path.join(REPO_ROOT, "modulecmd")
+
+
+# the source of a simple modulefile.  load is the body of its load method.
+def modulefile(description = None, load = "pass", dependencies = ()):
+    lines = ["import pyenv",
+             "",
+             "class Module(pyenv.Module):",
+             "    dependencies = %r" % (list(dependencies),)]
+    if (description is not None):
+        lines.append("    description = %r" % description)
+    lines.extend(["",
+                  "    def load(self, env, shell):",
+                  "        %s" % load,
+                  "",
+                  "    def unload(self, env, shell):",
+                  "        self.unload_by_reversal(env, shell)",
+                  ""])
+    return "\n".join(lines)
+
+
+# a test case with a scratch directory to write module trees in, and a cache directory of
+# its own.  modulecmd is run in a separate process, since it relies on process-global
+# state.
+class ModuleTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp(prefix = "pyenv-test-")
+        self.cache_dir = os.path.join(self.scratch, "cache")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+
+    # the absolute path of path, which is relative to the scratch directory.
+    def path(self, *components):
+        return os.path.join(self.scratch, *components)
+
+
+    # write the modulefile for module_name under the root root (relative to the scratch
+    # directory).  the file and its directories are made old enough for the indexes to
+    # trust their mtimes.
+    def write_module(self, root, module_name, source):
+        module_parts = module_name.split(".")
+        module_path = self.path(root, *module_parts[:-1] + ["%s.py" % module_parts[-1]])
+        if (not os.path.isdir(os.path.dirname(module_path))):
+            os.makedirs(os.path.dirname(module_path))
+        with open(module_path, "w") as fh:
+            fh.write(source)
+
+        for ix in range(len(module_parts) - 1, -1, -1):
+            self.age(self.path(root, *module_parts[:ix]))
+        self.age(module_path)
+        return module_path
+
+
+    # move the mtime of path an hour into the past.
+    @staticmethod
+    def age(path, seconds = 3600):
+        then = time.time() - seconds
+        os.utime(path, (then, then))
+
+
+    def environ(self, **variables):
+        environ = {"PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+                   "HOME": self.scratch,
+                   "PYTHONPATH": REPO_ROOT,
+                   "PYENV_CACHE_DIR": self.cache_dir}
+        environ.update(variables)
+        return environ
+
+
+    # run modulecmd with args and the given environment variables, and return its exit
+    # status, the commands it produced and what it wrote to stderr.
+    def modulecmd(self, args, cwd = None, **variables):
+        process = subprocess.Popen([sys.executable, MODULECMD,
+                                    "-s", "bash", "--output", "stdout"] + list(args),
+                                   stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                   cwd = cwd or self.scratch,
+                                   env = self.environ(**variables))
+        stdout, stderr = process.communicate()
+        return (process.returncode, stdout.decode("utf-8"), stderr.decode("utf-8"))
+
+
+# run function with the given environment variables set in os.environ, and return what it
+# returns.
+def with_variables(variables, function):
+    import os
+
+    saved_environ = dict(os.environ)
+    os.environ.update(variables)
+    try:
+        return function()
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environ)
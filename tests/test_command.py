@@ -0,0 +1,60 @@
+# -*- Mode: Python -*-
+
+import re
+import subprocess
+import sys
+import unittest
+
+from support import MODULECMD, ModuleTreeTestCase, modulefile
+
+# run modulecmd (the first argument) in this process, then list the pyenv modules that
+# were imported.
+IMPORTED_MODULES_SCRIPT = """
+import runpy
+import sys
+
+sys.argv = sys.argv[1:2] + ["-s", "bash", "--output", "stdout"] + sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name = "__main__")
+sys.stdout.write("imported: " + " ".join(sorted([name
+                                                 for name in sys.modules
+                                                 if name.startswith("pyenv")])) + "\\n")
+"""
+
+
+class LightActionTest(ModuleTreeTestCase):
+    def setUp(self):
+        ModuleTreeTestCase.setUp(self)
+
+        self.write_module("mods", "tools.a", modulefile(load = "shell.add_env('A', '1')"))
+
+
+    # the commands an action produced and the pyenv modules it imported.
+    def run_action(self, args, **variables):
+        process = subprocess.Popen([sys.executable, "-c", IMPORTED_MODULES_SCRIPT,
+                                    MODULECMD] + args,
+                                   stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                                   cwd = self.scratch,
+                                   env = self.environ(PYENV_PATH = self.path("mods"),
+                                                      **variables))
+        stdout, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, stderr)
+
+        out, imported = stdout.decode("utf-8").rsplit("imported: ", 1)
+        return (out, set(imported.split()))
+
+
+    # module-level __getattr__, which the lazy imports of the package rely on, needs 3.7.
+    @unittest.skipIf(sys.version_info < (3, 7), "the package is imported eagerly")
+    def test_loaded_imports_no_database(self):
+        out, imported = self.run_action(["load", "tools.a"])
+        self.assertIn("pyenv.environment", imported)
+        state = dict(re.findall(r"export (PYENV_DATA_\d+)='([^']*)'", out))
+
+        out, imported = self.run_action(["loaded"], **state)
+        self.assertIn("echo 'tools.a'", out)
+        self.assertNotIn("pyenv.db", imported)
+        self.assertNotIn("pyenv.environment", imported)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- Mode: Python -*-
+
+import os
+import sys
+import unittest
+
+from support import REPO_ROOT, ModuleTreeTestCase, modulefile, with_variables
+
+sys.path.insert(0, REPO_ROOT)
+
+
+class RelativeRootTest(ModuleTreeTestCase):
+    # the metadata of modules found by a scan of a relative PYENV_PATH entry.
+    def test_details_with_relative_pyenv_path(self):
+        self.write_module("mods", "lib.mpi", modulefile(description = "MPI"))
+        self.write_module("mods", "lib.fftw", modulefile(description = "FFTW"))
+
+        status, out, err = self.modulecmd(["avail", "--details", "lib"], PYENV_PATH = "mods")
+        self.assertEqual(status, 0, err)
+        self.assertIn("lib.fftw - FFTW", out)
+        self.assertIn("lib.mpi - MPI", out)
+        self.assertNotIn("unreadable", out)
+
+
+    def test_search_with_relative_pyenv_path(self):
+        self.write_module("mods", "lib.mpi", modulefile(description = "message passing"))
+
+        status, out, err = self.modulecmd(["search", "passing"], PYENV_PATH = "./mods/")
+        self.assertEqual(status, 0, err)
+        self.assertIn("lib.mpi - message passing", out)
+
+
+class CheckSyntaxTest(ModuleTreeTestCase):
+    def setUp(self):
+        ModuleTreeTestCase.setUp(self)
+
+        self.write_module("first", "tools.x", "x = 1\n")
+        self.valid_path = self.write_module("second", "tools.x", modulefile())
+        self.write_module("first", "tools.y", "def broken(:\n")
+        self.write_module("second", "tools.y", "y = 1\n")
+        self.write_module("second", "tools.z", modulefile())
+
+
+    # run get_all_modules with check_syntax on a fresh database of both roots, and return
+    # the module names and the modulefiles it settled on.
+    def get_all_modules(self, patterns = None):
+        from pyenv.db import ModuleDatabase
+
+        def get_all_modules():
+            mdb = ModuleDatabase()
+            module_names = mdb.get_all_modules(check_syntax = True, patterns = patterns)
+            return (module_names, dict(mdb.database_cache))
+
+        return with_variables({"PYENV_PATH": os.pathsep.join([self.path("first"),
+                                                               self.path("second")]),
+                               "PYENV_CACHE_DIR": self.cache_dir},
+                              get_all_modules)
+
+
+    # an invalid modulefile in the first root falls back to a valid one in a later root.
+    def test_falls_back_to_later_root(self):
+        for patterns in (None, ["tools"], ["tools.x", "tools.y", "tools.z"], ["tools.*"]):
+            module_names, database_cache = self.get_all_modules(patterns)
+            self.assertEqual(module_names, ["tools.x", "tools.z"], patterns)
+            self.assertEqual(database_cache["tools.x"], self.valid_path)
+            self.assertNotIn("tools.y", database_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
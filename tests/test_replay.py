@@ -0,0 +1,45 @@
+# -*- Mode: Python -*-
+
+import os
+import unittest
+
+from support import ModuleTreeTestCase, modulefile
+
+
+class ReplayCacheTest(ModuleTreeTestCase):
+    def load(self, module_name):
+        return self.modulecmd(["load", module_name],
+                              PYENV_PATH = self.path("mods"),
+                              PYENV_REPLAY_CACHE = "1")
+
+
+    def replay_files(self):
+        replay_dir = os.path.join(self.cache_dir, "replay")
+        if (not os.path.isdir(replay_dir)):
+            return []
+        return os.listdir(replay_dir)
+
+
+    def test_load_is_recorded(self):
+        self.write_module("mods", "tools.plain", modulefile(load = "shell.add_env('A', '1')"))
+
+        status, out, err = self.load("tools.plain")
+        self.assertEqual(status, 0, err)
+        self.assertIn("export A='1'", out)
+        self.assertEqual(len(self.replay_files()), 1)
+
+
+    # a load whose op log cannot be pickled still succeeds; it is just not cached.
+    def test_unpicklable_op_log(self):
+        self.write_module("mods", "tools.bulk",
+                          modulefile(load = "shell.write_bulk(line for line in ['a', 'b'])"))
+
+        for attempt in range(2):
+            status, out, err = self.load("tools.bulk")
+            self.assertEqual(status, 0, err)
+            self.assertIn("printf '%s\\n' 'a' 'b'", out)
+        self.assertEqual(self.replay_files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- Mode: Python -*-
+
+import os
+import re
+import unittest
+
+from support import ModuleTreeTestCase, modulefile
+
+
+class SearchTest(ModuleTreeTestCase):
+    def setUp(self):
+        ModuleTreeTestCase.setUp(self)
+
+        for module_no in range(40):
+            self.write_module("mods", "tools.t%02d" % module_no,
+                              modulefile(description = "tool number %d" % module_no))
+        self.widget_path = self.write_module("mods", "tools.widget",
+                                             modulefile(description = "alpha widget"))
+
+
+    def search(self, *args):
+        status, out, err = self.modulecmd(["--timings", "search"] + list(args),
+                                          PYENV_PATH = self.path("mods"))
+        self.assertEqual(status, 0, err)
+        stats = int(re.search(r"\bstat (\d+)", err).group(1))
+        return out, stats
+
+
+    # rewrite the widget's modulefile in place, leaving its directory's mtime alone.
+    def edit_widget(self, description):
+        dir_st = os.stat(os.path.dirname(self.widget_path))
+        with open(self.widget_path, "w") as fh:
+            fh.write(modulefile(description = description))
+        self.age(self.widget_path, 1800)
+        os.utime(os.path.dirname(self.widget_path), (dir_st.st_atime, dir_st.st_mtime))
+
+
+    def test_warm_query_stats_directories_and_results(self):
+        self.search("widget")
+
+        out, stats = self.search("widget")
+        self.assertIn("tools.widget - alpha widget", out)
+        # the root, tools and the widget's modulefile; not every modulefile.
+        self.assertTrue(stats <= 3, stats)
+
+
+    def test_edited_description(self):
+        self.search("alpha")
+        self.edit_widget("beta gadget")
+
+        out, stats = self.search("alpha")
+        self.assertNotIn("tools.widget", out)
+
+        out, stats = self.search("beta")
+        self.assertIn("tools.widget - beta gadget", out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- Mode: Python -*-
+
+import os
+import re
+import unittest
+
+from support import ModuleTreeTestCase, modulefile
+
+
+class SessionTest(ModuleTreeTestCase):
+    def setUp(self):
+        ModuleTreeTestCase.setUp(self)
+
+        self.write_module("mods", "tools.a", modulefile(load = "shell.add_env('A', '1')"))
+        self.write_module("mods", "tools.b", modulefile(load = "shell.add_env('B', '1')"))
+
+
+    # load modules in session mode, and return the session token.
+    def load(self, module_name, **variables):
+        status, out, err = self.modulecmd(["load", module_name],
+                                          PYENV_PATH = self.path("mods"),
+                                          PYENV_STATE_MODE = "session", **variables)
+        self.assertEqual(status, 0, err)
+        return re.search(r"export PYENV_SESSION='([0-9a-f]+)'", out).group(1)
+
+
+    def session_file(self, token):
+        return os.path.join(self.cache_dir, "sessions", token)
+
+
+    def test_missing_session_is_reported(self):
+        token = self.load("tools.a")
+        os.unlink(self.session_file(token))
+
+        status, out, err = self.modulecmd(["load", "tools.b"],
+                                          PYENV_PATH = self.path("mods"),
+                                          PYENV_SESSION = token)
+        self.assertNotEqual(status, 0)
+        self.assertIn(token, err)
+        self.assertNotIn("PYENV_SESSION", out)
+
+        status, out, err = self.modulecmd(["loaded"], PYENV_SESSION = token)
+        self.assertNotEqual(status, 0)
+        self.assertIn(token, err)
+
+
+    # pretend an old session file was last used long ago, and that the session directory
+    # has not been pruned for a while.
+    def make_stale(self, token):
+        self.age(self.session_file(token), 400 * 24 * 60 * 60)
+        stamp_path = os.path.join(self.cache_dir, "sessions", ".pruned")
+        if (os.path.exists(stamp_path)):
+            os.unlink(stamp_path)
+
+
+    def test_sessions_are_kept_by_default(self):
+        token = self.load("tools.a")
+        self.make_stale(token)
+
+        self.load("tools.b")
+        self.assertTrue(os.path.exists(self.session_file(token)))
+
+
+    def test_sessions_are_pruned_with_max_age(self):
+        token = self.load("tools.a")
+        self.make_stale(token)
+
+        self.load("tools.b", PYENV_SESSION_MAX_AGE = "86400")
+        self.assertFalse(os.path.exists(self.session_file(token)))
+
+
+if __name__ == "__main__":
+    unittest.main()